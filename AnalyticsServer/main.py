@@ -0,0 +1,383 @@
+"""HTTP server answering the queries of the chart apps and the report
+from one warm copy of the order data.
+
+the orders are loaded and indexed once at startup. requests are read by
+an asyncio loop and the queries and chart rendering run on a thread
+pool, so a slow chart does not hold up the other connections. the data
+never changes while the server runs, so responses are kept in an LRU
+cache and repeated requests skip the executor.
+
+    GET /customers                       customer ids
+    GET /customers/<id>                  CustomerApp series as json
+    GET /customers/<id>/<chart>.png      purchases, amount or products
+    GET /products                        product names
+    GET /products/<name>                 SalesApp series as json
+    GET /products/<name>/<chart>.png     sales or price
+    GET /top?k=5&by=units&month=         SalesReport best sellers as json
+    GET /report.png?k=5&by=units&month=  SalesReport chart
+
+charts can be requested as .svg as well.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import sys
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aggregation import mean_price  # noqa: E402
+from common.cache import LRUCache  # noqa: E402
+from common.cube import OrderCube  # noqa: E402
+from common.instrumentation import instrument  # noqa: E402
+from common.options import (DEFAULT_CHUNK_SIZE, IMAGE_FORMATS,  # noqa: E402
+                            RANKINGS, add_data_arguments,
+                            check_data_arguments)
+from common.rendering import HeadlessRenderer  # noqa: E402
+from common.rendering import customer_charts, draw_chart  # noqa: E402
+from common.rendering import draw_report, product_charts  # noqa: E402
+from common.sql import SqlOrderStore  # noqa: E402
+from common.storage import load_orders  # noqa: E402
+
+
+RESPONSE_CACHE_SIZE = 4096
+# requests carry no body, a larger one is refused rather than read
+MAX_BODY_BYTES = 64 * 2 ** 10
+CONTENT_TYPES = {
+    "json": "application/json",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Content Too Large",
+    500: "Internal Server Error",
+}
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def json_body(data) -> tuple:
+    return "json", json.dumps(data).encode()
+
+
+def body_length(headers: dict) -> int:
+    """the Content-Length of a request, HttpError if it is not a
+    non-negative integer or over MAX_BODY_BYTES"""
+    value = headers.get("content-length", "0")
+    if not (value.isascii() and value.isdigit()):
+        raise HttpError(400, f"Bad Content-Length {value!r}")
+    length = int(value)
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+    return length
+
+
+def split_chart(file_name: str) -> tuple:
+    """("sales", "png") for "sales.png" """
+    name, _, image_format = file_name.rpartition(".")
+    if image_format not in IMAGE_FORMATS:
+        raise HttpError(404, f"Unknown chart {file_name}")
+    return name, image_format
+
+
+class AnalyticsService:
+    """the queries of the three apps as (format, body) responses, safe to
+    call from several threads at once"""
+
+    def __init__(self, cube):
+        self.cube = cube
+        # Figures are not shared between threads
+        self._local = threading.local()
+
+    def renderer(self, image_format: str, figsize=(6.4, 4.8)):
+        key = (image_format, figsize)
+        renderers = self._local.__dict__.setdefault("renderers", dict())
+        if key not in renderers:
+            renderers[key] = HeadlessRenderer(image_format=image_format,
+                                              figsize=figsize)
+        return renderers[key]
+
+    @instrument
+    def handle(self, path: str, query: dict) -> tuple:
+        parts = [unquote(part) for part in path.split("/") if part]
+        if parts == ["customers"]:
+            return json_body(self.cube.customers().tolist())
+        if parts == ["products"]:
+            return json_body([str(title) for title in self.cube.titles()])
+        if parts == ["top"]:
+            return self.top(**self.report_params(query))
+        if parts == ["report.png"] or parts == ["report.svg"]:
+            return self.report(split_chart(parts[0])[1],
+                               **self.report_params(query))
+        if len(parts) in (2, 3) and parts[0] == "customers":
+            try:
+                customer_id = int(parts[1])
+            except ValueError:
+                raise HttpError(400, f"Bad customer code {parts[1]}")
+            if len(parts) == 2:
+                return self.customer(customer_id)
+            return self.chart(customer_charts, customer_id, parts[2])
+        if len(parts) in (2, 3) and parts[0] == "products":
+            if len(parts) == 2:
+                return self.product(parts[1])
+            return self.chart(product_charts, parts[1], parts[2])
+        raise HttpError(404, f"Unknown path {path}")
+
+    @staticmethod
+    def report_params(query: dict) -> dict:
+        try:
+            k = int(query.get("k", ["5"])[0])
+            month = query.get("month", [""])[0]
+            month = int(month) if month else None
+        except ValueError:
+            raise HttpError(400, "k and month must be integers")
+        by = query.get("by", ["units"])[0]
+        if by not in RANKINGS:
+            raise HttpError(400, f"by must be one of {sorted(RANKINGS)}")
+        if month is not None and not 1 <= month <= 12:
+            raise HttpError(400, "month must be between 1 and 12")
+        return {"k": k, "by": by, "month": month}
+
+    def customer(self, customer_id: int) -> tuple:
+        monthly_stats = self.cube.monthly(customer_id=customer_id)
+        if monthly_stats.empty:
+            raise HttpError(404, f"Customer code {customer_id} not found")
+        item_stats = self.cube.per_title(customer_id=customer_id)
+        return json_body({
+            "customer_id": customer_id,
+            "months": monthly_stats.index.tolist(),
+            "purchases": monthly_stats["count"].tolist(),
+            "amount": monthly_stats["total_price"].tolist(),
+            "products": {
+                "titles": [str(title) for title in item_stats.index],
+                "amount": item_stats["total_price"].tolist(),
+            },
+        })
+
+    def product(self, title: str) -> tuple:
+        monthly_stats = self.cube.monthly(title=title)
+        if monthly_stats.empty:
+            raise HttpError(404, f"Product {title} not found")
+        return json_body({
+            "title": title,
+            "months": monthly_stats.index.tolist(),
+            "sales": monthly_stats["count"].tolist(),
+            "price": mean_price(monthly_stats).tolist(),
+        })
+
+    def top(self, k: int, by: str, month: int) -> tuple:
+        items = self.cube.top_titles(k=k, by=by, month=month)
+        item_stats = self.cube.monthly_per_title(items.index)
+        best_sellers = list()
+        for title, value in zip(items.index, items.tolist()):
+            monthly_stats = item_stats.loc[title]
+            best_sellers.append({
+                "title": str(title),
+                "value": value,
+                "months": monthly_stats.index.tolist(),
+                "sales": monthly_stats["count"].tolist(),
+                "purchase": monthly_stats["total_price"].tolist(),
+            })
+        return json_body({"by": by, "month": month, "items": best_sellers})
+
+    def chart(self, charts, key, file_name: str) -> tuple:
+        name, image_format = split_chart(file_name)
+        try:
+            chart = charts(self.cube, key).get(name)
+        except KeyError:
+            raise HttpError(404, f"{key} not found")
+        if chart is None:
+            raise HttpError(404, f"Unknown chart {name}")
+        renderer = self.renderer(image_format)
+        draw_chart(renderer, chart)
+        return image_format, renderer.image_bytes()
+
+    def report(self, image_format: str, k: int, by: str,
+               month: int) -> tuple:
+        items = self.cube.top_titles(k=k, by=by, month=month).index
+        item_stats = self.cube.monthly_per_title(items)
+        renderer = self.renderer(image_format, figsize=(12.8, 4.8))
+        draw_report(renderer, items, item_stats)
+        return image_format, renderer.image_bytes()
+
+
+class AnalyticsServer:
+    """a minimal HTTP/1.1 server with keep-alive, GET and HEAD only"""
+
+    def __init__(self, service: AnalyticsService, executor,
+                 cache_size: int = RESPONSE_CACHE_SIZE):
+        self.service = service
+        self.executor = executor
+        self.responses = LRUCache(maxsize=cache_size)
+
+    async def respond(self, method: str, target: str) -> tuple:
+        if method not in ("GET", "HEAD"):
+            return 405, *json_body({"error": f"{method} not allowed"})
+        response = self.responses.get(target)
+        if response is not None:
+            return response
+        url = urlsplit(target)
+        loop = asyncio.get_running_loop()
+        try:
+            body_format, body = await loop.run_in_executor(
+                self.executor, self.service.handle, url.path,
+                parse_qs(url.query))
+        except HttpError as e:
+            return e.status, *json_body({"error": str(e)})
+        except Exception as e:
+            logging.exception(f"{target} failed")
+            return 500, *json_body({"error": str(e)})
+        response = 200, body_format, body
+        self.responses.put(target, response)
+        return response
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                try:
+                    method, target, version = (
+                        request_line.decode("latin-1").split())
+                except ValueError:
+                    break
+                # a body is never used, but must not be read as the next
+                # request. without a valid length the next request cannot
+                # be found, the connection is answered and closed
+                try:
+                    content_length = body_length(headers)
+                except HttpError as e:
+                    self.write_response(writer, method, e.status,
+                                        *json_body({"error": str(e)}),
+                                        keep_alive=False)
+                    await writer.drain()
+                    break
+                if content_length:
+                    await reader.readexactly(content_length)
+                status, body_format, body = await self.respond(method,
+                                                               target)
+                keep_alive = (headers.get("connection") != "close"
+                              and version == "HTTP/1.1")
+                self.write_response(writer, method, status, body_format,
+                                    body, keep_alive=keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def write_response(writer: asyncio.StreamWriter, method: str,
+                       status: int, body_format: str, body: bytes,
+                       keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: {CONTENT_TYPES[body_format]}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+            f"\r\n\r\n".encode("latin-1"))
+        if method != "HEAD":
+            writer.write(body)
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host,
+                                            port)
+        async with server:
+            await server.serve_forever()
+
+
+@instrument
+def load_cube(file_name: str, backend: str = "cube",
+              chunk_size: int = None):
+    if backend == "sqlite":
+        return SqlOrderStore.cached(
+            file_name, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+
+    def read_cube():
+        if chunk_size:
+            return OrderCube.from_file(file_name, chunk_size=chunk_size)
+        return OrderCube.from_orders(load_orders(file_name))
+
+    cube = OrderCube.cached(file_name, read_cube)
+    # build the index now rather than on the first request
+    cube.index
+    return cube
+
+
+@instrument
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Order analytics server"
+    )
+    add_data_arguments(parser)
+    parser.add_argument("--host",
+                        help="Address to listen on",
+                        default="127.0.0.1",
+                        )
+    parser.add_argument("--port",
+                        help="Port to listen on",
+                        type=int,
+                        default=8000,
+                        )
+    parser.add_argument("--workers",
+                        help="Number of query and rendering threads",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        )
+    parser.add_argument("--cache-size",
+                        help="Number of responses kept in memory",
+                        type=int,
+                        default=RESPONSE_CACHE_SIZE,
+                        )
+    args = parser.parse_args()
+    check_data_arguments(parser, args)
+    return args
+
+
+def main():
+    args = arg_input_parser()
+    try:
+        cube = load_cube(args.data_file, backend=args.backend,
+                         chunk_size=args.chunk_size)
+    except FileNotFoundError:
+        logging.error(f"{args.data_file} file not found.")
+        return
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    server = AnalyticsServer(AnalyticsService(cube), executor,
+                             cache_size=args.cache_size)
+    logging.info(f"Serving {cube.orders_count} orders on "
+                 f"http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,228 @@
-import matplotlib.pyplot as plt
+"""the best selling products report.
+
+pandas, matplotlib and the order cube are only imported once a report
+is requested, so that the command line starts without them.
+"""
 import logging
-import pandas as pd
 import argparse
+import os
+import shutil
+import sys
+import time
+import typing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.instrumentation import instrument  # noqa: E402
+from common.options import (DEFAULT_CHUNK_SIZE, FILE_ADDRESS,  # noqa: E402
+                            REPORT_CACHE_DIR, add_report_arguments,
+                            check_report_arguments)
 
+if typing.TYPE_CHECKING:
+    # only for the annotations, both import pandas
+    from common.cache import DiskCache
+    from common.cube import OrderCube
 
-FILE_ADDRESS = "../../1/1/sample.json"
+
+REPORT_FIGSIZE = (12.8, 4.8)
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
 
-def log_decorator(func):
-    def wrapper(*args, **kwargs):
-        logging.info(f"{func.__name__} was called")
-        return func(*args, **kwargs)
+class SalesReport:
+    def __init__(self, file_name: str = FILE_ADDRESS,
+                 chunk_size: int = None, cache: "DiskCache" = None,
+                 backend: str = "cube", processes: int = None):
+        self.file_name = file_name
+        self.sales_data = None
+        self.chunk_size = chunk_size
+        # the shards or month partitions of a dataset directory are
+        # aggregated by this many processes, None for one per CPU
+        self.processes = processes
+        # "sqlite" answers the queries with SQL over a database copy of
+        # the orders instead of the in-memory cube
+        self.backend = backend
+        self._cube = None
+        # results are looked up in the cache under the fingerprint of the
+        # orders file, the cube is only loaded on a miss
+        self.cache = cache
+        self.fingerprint = None
+        self._partitioned = None
+        if cache is not None:
+            from common.storage import file_fingerprint
+            try:
+                self.fingerprint = file_fingerprint(file_name)
+            except FileNotFoundError:
+                self.cache = None
 
-    return wrapper
+    @property
+    def cube(self) -> "OrderCube":
+        if self._cube is None:
+            from common.cube import OrderCube
+            from common.sql import SqlOrderStore
+            # the cube and its index are reused from the previous run when
+            # the orders file did not change
+            try:
+                if self.backend == "sqlite":
+                    self._cube = SqlOrderStore.cached(
+                        self.file_name,
+                        chunk_size=self.chunk_size or DEFAULT_CHUNK_SIZE)
+                else:
+                    self._cube = OrderCube.cached(
+                        self.file_name,
+                        lambda: self.read_cube(self.file_name))
+            except FileNotFoundError:
+                logging.error("sales_data.json file not found.")
+                self._cube = OrderCube()
+        return self._cube
 
+    @cube.setter
+    def cube(self, cube: "OrderCube"):
+        self._cube = cube
 
-class SalesReport:
-    def __init__(self, file_name: str = FILE_ADDRESS):
+    @property
+    def partitioned(self) -> bool:
+        """the orders are a month partitioned dataset directory"""
+        if self._partitioned is None:
+            from common.partitions import is_partitioned
+            try:
+                self._partitioned = is_partitioned(self.file_name)
+            except FileNotFoundError:
+                self._partitioned = False
+        return self._partitioned
+
+    def filtered_cube(self, filters: dict) -> "OrderCube":
+        """the cube of the orders matching filters. only used on a
+        partitioned dataset, which then reads the partitions that can
+        match only; otherwise, or once it is loaded, the full cube
+        answers"""
+        if (self._cube is not None or self.backend != "cube"
+                or not self.partitioned):
+            return self.cube
+        from common.cube import OrderCube
+        return OrderCube.cached(
+            self.file_name, lambda: self.read_cube(self.file_name, filters),
+            filters=filters)
+
+    def read_cube(self, file_name: str, filters: dict = None):
+        from common.cube import OrderCube
+        from common.storage import file_format
+        if file_format(file_name) == "manifest":
+            # every partition is aggregated on its own, in parallel, and
+            # the monthly stats are merged into one cube
+            return OrderCube.from_file(
+                file_name, chunk_size=self.chunk_size or DEFAULT_CHUNK_SIZE,
+                processes=self.processes, filters=filters)
+        if self.chunk_size:
+            # out of core: the orders are streamed into the cube and only
+            # the cube is kept
+            return OrderCube.from_file(file_name, chunk_size=self.chunk_size)
         self.sales_data = self.load_data(file_name)
+        cube = self.build_cube(self.sales_data)
+        # only the cube is queried, the order rows are not kept
+        self.sales_data = None
+        return cube
 
     @staticmethod
-    @log_decorator
+    @instrument
     def load_data(file_name: str = "sample.json"):
+        from common.storage import load_orders
         try:
-            data_frame = pd.read_json(file_name)
+            data_frame = load_orders(file_name)
             return data_frame
         except FileNotFoundError:
             logging.error("sales_data.json file not found.")
             return None
 
-    @log_decorator
-    def find_most_sales_item(self) -> list:
-        items = self.sales_data["title"].drop_duplicates().sort_values()
-        df_items = pd.DataFrame(index=items,
-                                columns=["total_sales"])
-        for item in items:
-            query_str = f"title == '{item}'"
-            total_sale = self.sales_data.query(query_str)["count"].sum()
-            df_items.loc[item] = total_sale
-        df_items = df_items.sort_values(by="total_sales", ascending=False)
-        return df_items.index[:5]
-
-    @log_decorator
-    def plot_sales_per_month(self, most_sales_item: list, axis):
+    @staticmethod
+    @instrument
+    def build_cube(data_frame):
+        from common.cube import OrderCube
+        if data_frame is None:
+            return OrderCube()
+        return OrderCube.from_orders(data_frame)
+
+    @instrument
+    def find_most_sales_item(self,
+                             k: int = 5,
+                             by: str = "units",
+                             month: int = None,
+                             customer_id: int = None) -> list:
+        # a month is ranked from the partitions of that month only
+        cube = self.cube if month is None else self.filtered_cube(
+            {"month": month})
+        item_sales = cube.top_titles(k=k, by=by, month=month,
+                                     customer_id=customer_id)
+        return item_sales.index
+
+    @instrument
+    def monthly_stats_of_items(self, items: list):
+        # the series of the best sellers of a month cover the whole year,
+        # of their titles only: the partitions are aggregated keeping
+        # those rows rather than building the full cube
+        if self._cube is None and self.backend == "cube" and self.partitioned:
+            return self.read_cube(
+                self.file_name, {"title": [str(item) for item in items]}
+            ).monthly_per_title(items)
+        return self.cube.monthly_per_title(items)
+
+    def cache_key(self, part: str, **params) -> str:
+        return self.cache.key(self.fingerprint, part=part, **params)
+
+    @instrument
+    def best_sellers(self, k: int = 5, by: str = "units",
+                     month: int = None) -> tuple:
+        """the k best selling items and their monthly stats, from the
+        result cache when the orders file did not change"""
+        import pandas as pd
+        if self.cache is not None:
+            items_key = self.cache_key("items", k=k, by=by, month=month)
+            stats_key = self.cache_key("stats", k=k, by=by, month=month)
+            items = self.cache.get_frame(items_key)
+            item_stats = self.cache.get_frame(stats_key)
+            if items is not None and item_stats is not None:
+                logging.info("Report series loaded from the cache")
+                return items.index, item_stats
+        items = self.find_most_sales_item(k=k, by=by, month=month)
+        item_stats = self.monthly_stats_of_items(items)
+        if self.cache is not None:
+            self.cache.put_frame(items_key,
+                                 pd.DataFrame(index=items.rename("title")))
+            self.cache.put_frame(stats_key, item_stats)
+        return items, item_stats
+
+    @instrument
+    def cached_report(self, output_dir: str, image_format: str,
+                      **params):
+        """copy the cached report image to output_dir, None if there is
+        none"""
+        if self.cache is None:
+            return None
+        cached_path = self.cache.get_file(
+            self.cache_key("image", image_format=image_format,
+                           figsize=REPORT_FIGSIZE, **params),
+            f".{image_format}")
+        if cached_path is None:
+            return None
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"report.{image_format}")
+        shutil.copyfile(cached_path, path)
+        return path
+
+    @instrument
+    def cache_report(self, path: str, image_format: str, **params):
+        if self.cache is None:
+            return
+        self.cache.put_file(self.cache_key("image", image_format=image_format,
+                                           figsize=REPORT_FIGSIZE, **params),
+                            path)
+
+    @instrument
+    def plot_sales_per_month(self, most_sales_item: list, axis, item_stats):
         for item in most_sales_item:
-            query_str = f"title == '{item}'"
-            product_orders = self.sales_data.query(query_str)
-            if product_orders.empty:
-                raise KeyError
-            months = product_orders["month"].drop_duplicates().sort_values()
+            monthly_stats = item_stats.loc[item]
+            months = monthly_stats.index
 
-            item_sales_per_month = self.sales_per_month(product_orders,
+            item_sales_per_month = self.sales_per_month(monthly_stats,
                                                         months=months,
                                                         )
             axis[0].plot(months, item_sales_per_month, label=item)
@@ -65,16 +235,13 @@ class SalesReport:
         # it's color
         axis[0].legend()
 
-    @log_decorator
-    def plot_purchase_per_month(self, most_sales_item: list, axis):
+    @instrument
+    def plot_purchase_per_month(self, most_sales_item: list, axis,
+                                item_stats):
         for item in most_sales_item:
-            query_str = f"title == '{item}'"
-            product_orders = self.sales_data.query(query_str)
-            if product_orders.empty:
-                raise KeyError
-            months = product_orders[
-                "month"].drop_duplicates().sort_values()
-            item_sales_per_month = self.purchase_per_month(product_orders,
+            monthly_stats = item_stats.loc[item]
+            months = monthly_stats.index
+            item_sales_per_month = self.purchase_per_month(monthly_stats,
                                                            months=months,
                                                            )
             axis[1].plot(months, item_sales_per_month, label=item)
@@ -88,52 +255,148 @@ class SalesReport:
         axis[1].legend()
 
     @staticmethod
-    @log_decorator
-    def arg_input_parser() -> int:
+    @instrument
+    def arg_input_parser() -> argparse.Namespace:
         parser = argparse.ArgumentParser(
             description="Sales data visualisation"
         )
-        parser.add_argument("-r",
-                            "--report",
-                            help="Report",
-                            action='store_true',
-                            )
+        add_report_arguments(parser)
         args = parser.parse_args()
-        flag_value = args.report
-        return flag_value
+        check_report_arguments(parser, args)
+        return args
 
     @staticmethod
-    @log_decorator
-    def sales_per_month(product_orders_in, months: list):
-        total_sales = list()
-        for month in months:
-            query_str = f"month == {month}"
-            total_sale = product_orders_in.query(query_str)["count"].sum()
-            total_sales.append(total_sale)
-        return pd.DataFrame(total_sales)
+    @instrument
+    def sales_per_month(monthly_stats, months: list):
+        import pandas as pd
+        total_sales = monthly_stats["count"].reindex(months, fill_value=0)
+        return pd.DataFrame(total_sales.to_numpy())
 
     @staticmethod
-    @log_decorator
-    def purchase_per_month(product_orders_in, months: list):
-        total_sales = list()
-        for month in months:
-            query_str = f"month == {month}"
-            total_sale = product_orders_in.query(query_str)[
-                "total_price"
-            ].sum()
-            total_sales.append(total_sale)
-        return pd.DataFrame(total_sales)
-
-
-def main():
-    sale_report = SalesReport(file_name=FILE_ADDRESS)
-    if sale_report.arg_input_parser():
-        most_sale_items = sale_report.find_most_sales_item()
+    @instrument
+    def purchase_per_month(monthly_stats, months: list):
+        import pandas as pd
+        total_sales = monthly_stats["total_price"].reindex(months,
+                                                           fill_value=0)
+        return pd.DataFrame(total_sales.to_numpy())
+
+
+def report_cache(args: argparse.Namespace):
+    from common.cache import DiskCache
+    if args.no_cache:
+        return None
+    cache_dir = args.cache_dir or os.path.join(
+        os.path.dirname(os.path.abspath(args.data_file)), REPORT_CACHE_DIR)
+    return DiskCache(cache_dir, max_bytes=int(args.cache_size * 2 ** 20))
+
+
+def stream_report(args: argparse.Namespace):
+    """the report of the orders published to args.stream, redrawn every
+    args.refresh seconds while they arrive. only the streaming statistics
+    are kept, the best sellers are approximate once there are more titles
+    than args.capacity"""
+    from common.streaming import (TITLES, StreamingStats, iter_messages,
+                                  open_stream)
+    stats = StreamingStats(by=args.by, capacity=args.capacity)
+    sale_report = SalesReport(file_name=args.stream)
+    sale_report.cube = stats
+    if args.output_dir:
+        from common.rendering import HeadlessRenderer
+        renderer = HeadlessRenderer(args.output_dir,
+                                    image_format=args.image_format,
+                                    figsize=REPORT_FIGSIZE)
+    else:
+        import matplotlib.pyplot as plt
+        plt.ion()
         figure, axis = plt.subplots(nrows=1, ncols=2)
-        sale_report.plot_sales_per_month(most_sale_items, axis)
-        sale_report.plot_purchase_per_month(most_sale_items, axis)
-        # To load the display window
+
+    started = time.perf_counter()
+
+    def draw():
+        if stats.empty:
+            return
+        items, item_stats = sale_report.best_sellers(k=args.top_k,
+                                                     by=args.by)
+        if args.output_dir:
+            report_axis = renderer.axes(2)
+        else:
+            report_axis = axis
+            for chart in report_axis:
+                chart.clear()
+        sale_report.plot_sales_per_month(items, report_axis, item_stats)
+        sale_report.plot_purchase_per_month(items, report_axis, item_stats)
+        if args.output_dir:
+            renderer.save("report")
+        else:
+            plt.pause(0.001)
+        elapsed = time.perf_counter() - started
+        customers = stats.distinct_customers(items)
+        logging.info(f"{stats.orders_count} orders in {elapsed:.2f}s "
+                     f"({stats.orders_count / elapsed:.0f} orders/s), best "
+                     "sellers: " + ", ".join(
+                         f"{item} (~{customers[item]:.0f} customers)"
+                         for item in items))
+
+    last_draw = started
+    with open_stream(args.stream, "rb") as stream:
+        for kind, payload in iter_messages(stream):
+            if kind == TITLES:
+                stats.add_titles(payload)
+                continue
+            stats.update(payload)
+            if time.perf_counter() - last_draw >= args.refresh:
+                draw()
+                last_draw = time.perf_counter()
+    draw()
+    logging.info("Totals per month\n"
+                 + stats.monthly()[["orders", "count",
+                                    "total_price"]].to_string())
+    if args.output_dir:
+        logging.info(f"Report written to {args.output_dir}")
+    else:
+        plt.ioff()
         plt.show()
+
+
+def main(args: argparse.Namespace = None):
+    if args is None:
+        args = SalesReport.arg_input_parser()
+    if args.stream:
+        stream_report(args)
+    elif args.report or args.output_dir:
+        sale_report = SalesReport(file_name=args.data_file,
+                                  chunk_size=args.chunk_size,
+                                  cache=report_cache(args),
+                                  backend=args.backend,
+                                  processes=args.processes)
+        params = {"k": args.top_k, "by": args.by, "month": args.month}
+        if args.output_dir:
+            path = sale_report.cached_report(args.output_dir,
+                                             args.image_format, **params)
+            if path is not None:
+                logging.info(f"Report copied from the cache to {path}")
+                return
+        most_sale_items, item_stats = sale_report.best_sellers(**params)
+        if args.output_dir:
+            from common.rendering import HeadlessRenderer
+            renderer = HeadlessRenderer(args.output_dir,
+                                        image_format=args.image_format,
+                                        figsize=REPORT_FIGSIZE)
+            axis = renderer.axes(2)
+        else:
+            # pyplot picks a GUI backend, only once a window is shown
+            import matplotlib.pyplot as plt
+            figure, axis = plt.subplots(nrows=1, ncols=2)
+        sale_report.plot_sales_per_month(most_sale_items, axis, item_stats)
+        sale_report.plot_purchase_per_month(most_sale_items, axis,
+                                            item_stats)
+        if args.output_dir:
+            path = renderer.save("report")
+            sale_report.cache_report(path, args.image_format, **params)
+            logging.info(f"Report written to {path}")
+        else:
+            # To load the display window
+            plt.show()
     else:
         logging.info("No arguments entered")
 
@@ -1,26 +1,42 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import matplotlib.pyplot as plt
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import pandas as pd
+import os
+import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.aggregation import mean_price  # noqa: E402
+from common.cache import LRUCache  # noqa: E402
+from common.cube import OrderCube  # noqa: E402
+from common.instrumentation import instrument  # noqa: E402
+from common.options import (FILE_ADDRESS,  # noqa: E402
+                            add_product_arguments, check_product_arguments)
+from common.sql import SqlOrderStore  # noqa: E402
+from common.storage import (DEFAULT_CHUNK_SIZE,  # noqa: E402
+                            downcast_float, load_orders)
+from common.tk_charts import EmbeddedChart  # noqa: E402
+from common.tk_tasks import run_in_background  # noqa: E402
 
-FILE_ADDRESS = "../../1/1/sample.json"
+
+SERIES_CACHE_SIZE = 128
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
 
-def log_decorator(func):
-    def wrapper(*args, **kwargs):
-        logging.info(f"{func.__name__} was called")
-        return func(*args, **kwargs)
-
-    return wrapper
-
-
 class SalesApp:
-    def __init__(self, master):
+    def __init__(self, master, file_name: str = FILE_ADDRESS,
+                 chunk_size: int = None, backend: str = "cube"):
         self.master = master
+        self.file_name = file_name
+        # with a chunk size the orders are streamed into the cube and
+        # only the cube is kept in memory
+        self.chunk_size = chunk_size
+        # "sqlite" answers the lookups with SQL over a database copy of
+        # the orders instead of the in-memory cube
+        self.backend = backend
+        # tkinter is only imported for the window, not to render files
+        from tkinter import ttk
         master.title('Sales and Price Charts')
 
         # Label
@@ -35,65 +51,160 @@ class SalesApp:
 
         # Button
         self.submit_button = ttk.Button(master, text="Submit",
-                                        command=self.plot_data)
+                                        command=self.plot_data,
+                                        state="disabled")
         self.submit_button.pack()
 
-        self.sales_data = self.load_data(FILE_ADDRESS)
-        self.add_price_field()
+        # Loading status
+        self.status_label = ttk.Label(master, text="Loading orders...")
+        self.status_label.pack()
+        self.progress_bar = ttk.Progressbar(master, mode="indeterminate",
+                                            maximum=100)
+        self.progress_bar.pack(fill="x")
+        self.progress_bar.start()
+
+        # Charts, drawn once and updated in place on every lookup
+        self.charts_frame = ttk.Frame(master)
+        self.charts_frame.pack(fill="both", expand=True)
+        self.charts = {
+            "sales": EmbeddedChart(self.charts_frame, kind="line",
+                                   x_label="Month",
+                                   y_label="Sales",
+                                   title="Sales per month",
+                                   color='tab:red'),
+            "price": EmbeddedChart(self.charts_frame, kind="line",
+                                   x_label="Month",
+                                   y_label="Price",
+                                   title="Price per month",
+                                   color='tab:blue'),
+        }
+        for chart in self.charts.values():
+            chart.widget().pack(side="left", fill="both", expand=True)
+
+        # the analysis runs off the Tk thread, results are cached per
+        # product name and cube version
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.series_cache = LRUCache(maxsize=SERIES_CACHE_SIZE)
+
+        # the orders are loaded in the background, Submit stays disabled
+        # until they are ready
+        self.sales_data = None
+        self.cube = OrderCube()
+        self.load_progress = None
+        run_in_background(master, self.executor,
+                          self.prepare_data, self.on_data_ready,
+                          file_name, on_poll=self.show_load_progress)
 
     @staticmethod
-    @log_decorator
-    def load_data(file_name: str = FILE_ADDRESS):
+    @instrument
+    def load_data(file_name: str = FILE_ADDRESS, progress=None):
+        return load_orders(file_name, progress=progress)
+
+    @staticmethod
+    @instrument
+    def build_cube(data_frame):
+        if data_frame is None:
+            return OrderCube()
+        return OrderCube.from_orders(data_frame)
+
+    def prepare_data(self, file_name: str):
+        """runs on the executor, must not touch any widget. the cube and
+        its index are reused from the previous launch when the orders file
+        did not change"""
+        if self.backend == "sqlite":
+            return SqlOrderStore.cached(
+                file_name, chunk_size=self.chunk_size or DEFAULT_CHUNK_SIZE,
+                progress=self.set_load_progress)
+        return OrderCube.cached(file_name,
+                                lambda: self.read_cube(file_name))
+
+    def read_cube(self, file_name: str):
+        if self.chunk_size:
+            return OrderCube.from_file(file_name,
+                                       chunk_size=self.chunk_size,
+                                       progress=self.set_load_progress)
+        self.sales_data = self.load_data(
+            file_name, progress=self.set_load_progress)
+        self.add_price_field()
+        cube = self.build_cube(self.sales_data)
+        # only the cube is queried, the order rows are not kept
+        self.sales_data = None
+        return cube
+
+    def set_load_progress(self, fraction: float):
+        self.load_progress = fraction
+
+    def show_load_progress(self):
+        if self.load_progress is None:
+            return
+        if str(self.progress_bar["mode"]) == "indeterminate":
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
+        self.progress_bar["value"] = self.load_progress * 100
+
+    @instrument
+    def on_data_ready(self, future):
+        from tkinter import messagebox
+        self.progress_bar.stop()
         try:
-            data_frame = pd.read_json(file_name)
-            return data_frame
+            self.cube = future.result()
         except FileNotFoundError:
             logging.error("sales_data.json file not found.")
-            messagebox.showerror(title="Error",
-                                 message="Data file not found.")
-            return None
+            self.status_label.configure(text="Data file not found.")
+            messagebox.showerror(title="Error", message="Data file not found.")
+            return
         except Exception as e:
             logging.error(msg=f"Error: {e}")
+            self.status_label.configure(text="Loading failed.")
             messagebox.showerror(title="Error",
                                  message=f"{e}. Please try again.")
-            return None
+            return
+        self.progress_bar.configure(mode="determinate", value=100)
+        orders_count = self.cube.orders_count
+        self.status_label.configure(text=f"{orders_count} orders loaded.")
+        self.submit_button.state(["!disabled"])
 
     def add_price_field(self):
         field = self.sales_data["total_price"].div(self.sales_data["count"])
-        self.sales_data["price"] = field
+        self.sales_data["price"] = downcast_float(field)
 
-    @log_decorator
+    @instrument
     def plot_data(self):
         product_name = self.entry.get()
+        key = (product_name, self.cube.version)
+        product_series = self.series_cache.get(key)
+        if product_series is not None:
+            self.plot_product_series(product_name, product_series)
+            return
+        self.submit_button.state(["disabled"])
+        run_in_background(self.master, self.executor,
+                          self.product_series,
+                          lambda future: self.on_series_ready(
+                              product_name, key, future),
+                          product_name)
+
+    def product_series(self, product_name: str):
+        monthly_stats = self.cube.monthly(title=product_name)
+        if monthly_stats.empty:
+            raise KeyError
+
+        months = monthly_stats.index
+        item_month_prices = self.mean_prices_per_month(monthly_stats,
+                                                       months=months,
+                                                       )
+
+        item_sales_per_month = self.sales_per_month(monthly_stats,
+                                                    months=months,
+                                                    )
+        return months, item_sales_per_month, item_month_prices
+
+    def on_series_ready(self, product_name: str, key, future):
+        from tkinter import messagebox
+        self.submit_button.state(["!disabled"])
         try:
-            query_str = f"title == '{product_name}'"
-            product_orders = self.sales_data.query(query_str)
-            if product_orders.empty:
-                raise KeyError
-
-            months = product_orders["month"].drop_duplicates().sort_values()
-            item_month_prices = self.mean_prices_per_month(product_orders,
-                                                           months=months,
-                                                           )
-
-            item_sales_per_month = self.sales_per_month(product_orders,
-                                                        months=months,
-                                                        )
-            self.plot_figs(x_data=months,
-                           y_data=item_sales_per_month,
-                           x_label="Month",
-                           y_label="Sales",
-                           title=f"Sales per month for {product_name}",
-                           color='tab:red'
-                           )
-
-            self.plot_figs(x_data=months,
-                           y_data=item_month_prices,
-                           x_label="Month",
-                           y_label="Price",
-                           title=f"Price per month for {product_name}",
-                           color='tab:blue'
-                           )
+            product_series = future.result()
+            self.series_cache.put(key, product_series)
+            self.plot_product_series(product_name, product_series)
 
         except KeyError:
             logging.error(f"Product {product_name} not found.")
@@ -105,47 +216,98 @@ class SalesApp:
             messagebox.showerror(title="Error",
                                  message=f"{e}. Please try again.")
 
-    @staticmethod
-    @log_decorator
-    def plot_figs(x_data,
-                  y_data,
-                  x_label: str,
-                  y_label: str,
-                  title: str,
-                  color: str):
-        fig, ax = plt.subplots()
-        ax.set_xlabel(x_label)
-        ax.set_ylabel(y_label, color=color)
-        ax.set_title(title)
-        ax.plot(x_data, y_data)
-        ax.tick_params(axis='y')
-        fig.tight_layout()
-        plt.show()
+    @instrument
+    def plot_product_series(self, product_name: str, product_series):
+        months, item_sales_per_month, item_month_prices = product_series
+        self.plot_figs(chart="sales",
+                       x_data=months,
+                       y_data=item_sales_per_month,
+                       title=f"Sales per month for {product_name}",
+                       )
+
+        self.plot_figs(chart="price",
+                       x_data=months,
+                       y_data=item_month_prices,
+                       title=f"Price per month for {product_name}",
+                       )
+
+    @instrument
+    def plot_figs(self, chart: str, x_data, y_data, title: str):
+        self.charts[chart].update(x_data, y_data.to_numpy(), title=title)
 
     @staticmethod
-    @log_decorator
-    def mean_prices_per_month(product_orders_in, months: list):
-        mean_prices = list()
-        for month in months:
-            query_str = f"month == {month}"
-            mean_price = product_orders_in.query(query_str)["price"].mean()
-            mean_prices.append(mean_price)
-        return pd.DataFrame(mean_prices)
+    @instrument
+    def mean_prices_per_month(monthly_stats, months: list):
+        mean_prices = mean_price(monthly_stats).reindex(months)
+        return pd.DataFrame(mean_prices.to_numpy())
 
     @staticmethod
-    @log_decorator
-    def sales_per_month(product_orders_in, months: list):
-        total_sales = list()
-        for month in months:
-            query_str = f"month == {month}"
-            total_sale = product_orders_in.query(query_str)["count"].sum()
-            total_sales.append(total_sale)
-        return pd.DataFrame(total_sales)
+    @instrument
+    def sales_per_month(monthly_stats, months: list):
+        total_sales = monthly_stats["count"].reindex(months, fill_value=0)
+        return pd.DataFrame(total_sales.to_numpy())
+
+
+@instrument
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Sales and price charts"
+    )
+    add_product_arguments(parser)
+    args = parser.parse_args()
+    check_product_arguments(parser, args)
+    return args
+
+
+@instrument
+def render_charts(file_name: str, output_dir: str, product_names: list,
+                  image_format: str = "png", processes: int = None,
+                  chunk_size: int = None, backend: str = "cube") -> int:
+    """render the charts of the given products, or of all of them when the
+    list is empty"""
+    from common.batch_render import render_in_parallel
+
+    def read_cube():
+        if chunk_size:
+            return OrderCube.from_file(file_name, chunk_size=chunk_size)
+        return OrderCube.from_orders(load_orders(file_name))
+
+    try:
+        if backend == "sqlite":
+            cube = SqlOrderStore.cached(
+                file_name, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+        else:
+            cube = OrderCube.cached(file_name, read_cube)
+    except FileNotFoundError:
+        logging.error(f"{file_name} file not found.")
+        return 0
+    keys = product_names or cube.titles()
+    written = render_in_parallel(kind="product",
+                                 cube=cube,
+                                 keys=keys,
+                                 output_dir=output_dir,
+                                 image_format=image_format,
+                                 processes=processes)
+    logging.info(f"{written} charts written to {output_dir}")
+    return written
 
 
-def main():
+def main(args: argparse.Namespace = None):
+    if args is None:
+        args = arg_input_parser()
+    if args.output_dir:
+        render_charts(file_name=args.data_file,
+                      output_dir=args.output_dir,
+                      product_names=list() if args.all else args.product,
+                      image_format=args.image_format,
+                      processes=args.processes,
+                      chunk_size=args.chunk_size,
+                      backend=args.backend)
+        return
+    import tkinter as tk
     root = tk.Tk()
-    SalesApp(root)
+    SalesApp(root, file_name=args.data_file,
+             chunk_size=args.chunk_size, backend=args.backend)
     root.mainloop()
 
 
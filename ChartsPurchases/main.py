@@ -1,26 +1,40 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import matplotlib.pyplot as plt
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import pandas as pd
-
-
-FILE_ADDRESS = "../../1/1/sample.json"
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.cache import LRUCache  # noqa: E402
+from common.cube import OrderCube  # noqa: E402
+from common.instrumentation import instrument  # noqa: E402
+from common.options import (FILE_ADDRESS,  # noqa: E402
+                            add_customer_arguments, check_customer_arguments)
+from common.sql import SqlOrderStore  # noqa: E402
+from common.storage import DEFAULT_CHUNK_SIZE, load_orders  # noqa: E402
+from common.tk_charts import EmbeddedChart  # noqa: E402
+from common.tk_tasks import run_in_background  # noqa: E402
+
+
+SERIES_CACHE_SIZE = 128
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
 
-def log_decorator(func):
-    def wrapper(*args, **kwargs):
-        logging.info(f"{func.__name__} was called")
-        return func(*args, **kwargs)
-
-    return wrapper
-
-
 class CustomerApp:
-    def __init__(self, master):
+    def __init__(self, master, file_name: str = FILE_ADDRESS,
+                 chunk_size: int = None, backend: str = "cube"):
         self.master = master
+        self.file_name = file_name
+        # with a chunk size the orders are streamed into the cube and
+        # only the cube is kept in memory
+        self.chunk_size = chunk_size
+        # "sqlite" answers the lookups with SQL over a database copy of
+        # the orders instead of the in-memory cube
+        self.backend = backend
+        # tkinter is only imported for the window, not to render files
+        from tkinter import ttk
         master.title('Customer Purchase Analysis')
 
         # Label
@@ -33,45 +47,151 @@ class CustomerApp:
 
         # Button
         self.submit_button = ttk.Button(master, text="Submit",
-                                        command=self.analyze_data)
+                                        command=self.analyze_data,
+                                        state="disabled")
         self.submit_button.pack()
 
-        self.customer_data = self.load_data(FILE_ADDRESS)
+        # Loading status
+        self.status_label = ttk.Label(master, text="Loading orders...")
+        self.status_label.pack()
+        self.progress_bar = ttk.Progressbar(master, mode="indeterminate",
+                                            maximum=100)
+        self.progress_bar.pack(fill="x")
+        self.progress_bar.start()
+
+        # Charts, drawn once and updated in place on every lookup
+        self.charts_frame = ttk.Frame(master)
+        self.charts_frame.pack(fill="both", expand=True)
+        self.charts = {
+            "purchases": EmbeddedChart(self.charts_frame, kind="bar",
+                                       x_label='Month',
+                                       y_label='Number of Purchases',
+                                       title='Number of Purchases Per Month',
+                                       color='red'),
+            "amount": EmbeddedChart(self.charts_frame, kind="bar",
+                                    x_label='Month',
+                                    y_label='Amount Spent',
+                                    title='Total Amount Spent Per Month',
+                                    color='green'),
+            "products": EmbeddedChart(self.charts_frame, kind="bar",
+                                      x_label='Item',
+                                      y_label='Number of Purchases',
+                                      title='Number of Each Product '
+                                            'Purchased',
+                                      color='orange'),
+        }
+        for chart in self.charts.values():
+            chart.widget().pack(side="left", fill="both", expand=True)
+
+        # the analysis runs off the Tk thread, results are cached per
+        # customer code and cube version
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.series_cache = LRUCache(maxsize=SERIES_CACHE_SIZE)
+
+        # the orders are loaded in the background, Submit stays disabled
+        # until they are ready
+        self.customer_data = None
+        self.cube = OrderCube()
+        self.load_progress = None
+        run_in_background(master, self.executor,
+                          self.prepare_data, self.on_data_ready,
+                          file_name, on_poll=self.show_load_progress)
+
+    @staticmethod
+    @instrument
+    def load_data(file_name: str = FILE_ADDRESS, progress=None):
+        return load_orders(file_name, progress=progress)
 
     @staticmethod
-    @log_decorator
-    def load_data(file_name: str = FILE_ADDRESS):
+    @instrument
+    def build_cube(data_frame):
+        if data_frame is None:
+            return OrderCube()
+        return OrderCube.from_orders(data_frame)
+
+    def prepare_data(self, file_name: str):
+        """runs on the executor, must not touch any widget. the cube and
+        its index are reused from the previous launch when the orders file
+        did not change"""
+        if self.backend == "sqlite":
+            return SqlOrderStore.cached(
+                file_name, chunk_size=self.chunk_size or DEFAULT_CHUNK_SIZE,
+                progress=self.set_load_progress)
+        return OrderCube.cached(file_name,
+                                lambda: self.read_cube(file_name))
+
+    def read_cube(self, file_name: str):
+        if self.chunk_size:
+            return OrderCube.from_file(file_name,
+                                       chunk_size=self.chunk_size,
+                                       progress=self.set_load_progress)
+        # only the cube is queried, the order rows are not kept
+        customer_data = self.load_data(file_name,
+                                       progress=self.set_load_progress)
+        return self.build_cube(customer_data)
+
+    def set_load_progress(self, fraction: float):
+        self.load_progress = fraction
+
+    def show_load_progress(self):
+        if self.load_progress is None:
+            return
+        if str(self.progress_bar["mode"]) == "indeterminate":
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
+        self.progress_bar["value"] = self.load_progress * 100
+
+    @instrument
+    def on_data_ready(self, future):
+        from tkinter import messagebox
+        self.progress_bar.stop()
         try:
-            data_frame = pd.read_json(file_name)
-            return data_frame
+            self.cube = future.result()
         except FileNotFoundError:
-            logging.error(f"{file_name} file not found.")
+            logging.error(f"{self.file_name} file not found.")
+            self.status_label.configure(text="Data file not found.")
             messagebox.showerror(title="Error", message="Data file not found.")
-            return None
+            return
         except Exception as e:
             logging.error(msg=f"Error: {e}")
+            self.status_label.configure(text="Loading failed.")
             messagebox.showerror(title="Error",
                                  message=f"{e}. Please try again.")
-            return None
+            return
+        self.progress_bar.configure(mode="determinate", value=100)
+        orders_count = self.cube.orders_count
+        self.status_label.configure(text=f"{orders_count} orders loaded.")
+        self.submit_button.state(["!disabled"])
 
-    @log_decorator
+    @instrument
     def analyze_data(self):
         customer_code = int(self.entry.get())
+        key = (customer_code, self.cube.version)
+        customer_series = self.series_cache.get(key)
+        if customer_series is not None:
+            self.plot_customer_series(customer_code, customer_series)
+            return
+        self.submit_button.state(["disabled"])
+        run_in_background(self.master, self.executor,
+                          self.customer_series,
+                          lambda future: self.on_series_ready(
+                              customer_code, key, future),
+                          customer_code)
+
+    def customer_series(self, customer_code: int):
+        monthly_stats = self.cube.monthly(customer_id=customer_code)
+        if monthly_stats.empty:
+            raise KeyError
+        item_stats = self.cube.per_title(customer_id=customer_code)
+        return monthly_stats, item_stats
+
+    def on_series_ready(self, customer_code: int, key, future):
+        from tkinter import messagebox
+        self.submit_button.state(["!disabled"])
         try:
-            query_str = f"customer_id == {customer_code}"
-            customer_orders = self.customer_data.query(query_str)
-            if customer_orders.empty:
-                raise KeyError
-            months = customer_orders["month"].drop_duplicates().sort_values()
-            self.plot_purchases_per_month(customer_orders, months=months)
-
-            query_str = f"customer_id == {customer_code}"
-            customer_orders = self.customer_data.query(query_str)
-            self.plot_amount_per_month(customer_orders, months=months)
-
-            items = customer_orders["title"].drop_duplicates().sort_values()
-            customer_orders = self.customer_data.query(query_str)
-            self.plot_product_num_per_month(customer_orders, items=items)
+            customer_series = future.result()
+            self.series_cache.put(key, customer_series)
+            self.plot_customer_series(customer_code, customer_series)
 
         except KeyError:
 
@@ -86,100 +206,135 @@ class CustomerApp:
             messagebox.showerror(title="Error",
                                  message=f"{e}. Please try again.")
 
-    @log_decorator
-    def plot_purchases_per_month(self, customer_orders, months: list):
-        order_per_month = self.order_per_month(customer_orders,
+    @instrument
+    def plot_customer_series(self, customer_code: int, customer_series):
+        monthly_stats, item_stats = customer_series
+        months = monthly_stats.index
+        self.plot_purchases_per_month(monthly_stats, months=months)
+        self.plot_amount_per_month(monthly_stats, months=months)
+
+        items = item_stats.index
+        self.plot_product_num_per_month(item_stats, items=items)
+
+    @instrument
+    def plot_purchases_per_month(self, monthly_stats, months: list):
+        order_per_month = self.order_per_month(monthly_stats,
                                                months=months,
                                                )
 
-        self.plot_bar_graph(x_data=months,
+        self.plot_bar_graph(chart="purchases",
+                            x_data=months,
                             y_data=order_per_month,
-                            x_label='Month',
-                            y_label='Number of Purchases',
-                            title='Number of Purchases Per Month',
-                            color='red'
                             )
 
-    @log_decorator
-    def plot_amount_per_month(self, customer_orders, months: list):
-        total_purchase_per_month = self.purchase_per_month(customer_orders,
+    @instrument
+    def plot_amount_per_month(self, monthly_stats, months: list):
+        total_purchase_per_month = self.purchase_per_month(monthly_stats,
                                                            months=months,
                                                            )
-        self.plot_bar_graph(x_data=months,
+        self.plot_bar_graph(chart="amount",
+                            x_data=months,
                             y_data=total_purchase_per_month,
-                            x_label='Month',
-                            y_label='Amount Spent',
-                            title='Total Amount Spent Per Month',
-                            color='green'
                             )
 
-    @log_decorator
-    def plot_product_num_per_month(self, customer_orders, items: list):
-        order_item_per_month = self.order_per_item(customer_orders,
+    @instrument
+    def plot_product_num_per_month(self, item_stats, items: list):
+        order_item_per_month = self.order_per_item(item_stats,
                                                    items=items
                                                    )
 
-        self.plot_bar_graph(x_data=items,
+        self.plot_bar_graph(chart="products",
+                            x_data=items,
                             y_data=order_item_per_month,
-                            x_label='Item',
-                            y_label='Number of Purchases',
-                            title='Number of Each Product Purchased',
-                            color='orange'
                             )
 
-    @staticmethod
-    @log_decorator
-    def plot_bar_graph(x_data,
-                       y_data,
-                       x_label: str,
-                       y_label: str,
-                       title: str,
-                       color: str):
-        plot_df = y_data
-        plot_df.columns = [y_label]
-        plot_df.index = x_data
-        plot_df.plot(kind='bar', color=color)
-        plt.title(title)
-        plt.xlabel(x_label)
-        plt.ylabel(y_label)
-        plt.show()
+    @instrument
+    def plot_bar_graph(self, chart: str, x_data, y_data):
+        """show y_data on one of the embedded charts, y_data is left as
+        it is"""
+        self.charts[chart].update(x_data, y_data.to_numpy())
 
     @staticmethod
-    @log_decorator
-    def order_per_month(customer_orders, months: list):
-        orders = list()
-        for month in months:
-            query_str = f"month == {month}"
-            order = customer_orders.query(query_str)["count"].sum()
-            orders.append(order)
-        return pd.DataFrame(orders)
+    @instrument
+    def order_per_month(monthly_stats, months: list):
+        orders = monthly_stats["count"].reindex(months, fill_value=0)
+        return pd.DataFrame(orders.to_numpy())
 
     @staticmethod
-    @log_decorator
-    def purchase_per_month(customer_orders, months: list):
-        total_purchases = list()
-        for month in months:
-            query_str = f"month == {month}"
-            print(customer_orders.query(query_str))
-            print(customer_orders.query(query_str)["total_price"])
-            total_p = customer_orders.query(query_str)["total_price"].sum()
-            total_purchases.append(total_p)
-        return pd.DataFrame(total_purchases)
+    @instrument
+    def purchase_per_month(monthly_stats, months: list):
+        total_purchases = monthly_stats["total_price"].reindex(months,
+                                                               fill_value=0)
+        return pd.DataFrame(total_purchases.to_numpy())
 
     @staticmethod
-    @log_decorator
-    def order_per_item(customer_orders, items: list):
-        total_purchases = list()
-        for item in items:
-            query_str = f"title == '{item}'"
-            total_p = customer_orders.query(query_str)["total_price"].sum()
-            total_purchases.append(total_p)
-        return pd.DataFrame(total_purchases)
-
-
-def main():
+    @instrument
+    def order_per_item(item_stats, items: list):
+        total_purchases = item_stats["total_price"].reindex(items,
+                                                            fill_value=0)
+        return pd.DataFrame(total_purchases.to_numpy())
+
+
+@instrument
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Customer purchase analysis"
+    )
+    add_customer_arguments(parser)
+    args = parser.parse_args()
+    check_customer_arguments(parser, args)
+    return args
+
+
+@instrument
+def render_charts(file_name: str, output_dir: str, customer_codes: list,
+                  image_format: str = "png", processes: int = None,
+                  chunk_size: int = None, backend: str = "cube") -> int:
+    """render the charts of the given customers, or of all of them when the
+    list is empty"""
+    from common.batch_render import render_in_parallel
+
+    def read_cube():
+        if chunk_size:
+            return OrderCube.from_file(file_name, chunk_size=chunk_size)
+        return OrderCube.from_orders(load_orders(file_name))
+
+    try:
+        if backend == "sqlite":
+            cube = SqlOrderStore.cached(
+                file_name, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+        else:
+            cube = OrderCube.cached(file_name, read_cube)
+    except FileNotFoundError:
+        logging.error(f"{file_name} file not found.")
+        return 0
+    keys = customer_codes or cube.customers()
+    written = render_in_parallel(kind="customer",
+                                 cube=cube,
+                                 keys=keys,
+                                 output_dir=output_dir,
+                                 image_format=image_format,
+                                 processes=processes)
+    logging.info(f"{written} charts written to {output_dir}")
+    return written
+
+
+def main(args: argparse.Namespace = None):
+    if args is None:
+        args = arg_input_parser()
+    if args.output_dir:
+        render_charts(file_name=args.data_file,
+                      output_dir=args.output_dir,
+                      customer_codes=list() if args.all else args.customer,
+                      image_format=args.image_format,
+                      processes=args.processes,
+                      chunk_size=args.chunk_size,
+                      backend=args.backend)
+        return
+    import tkinter as tk
     root = tk.Tk()
-    CustomerApp(root)
+    CustomerApp(root, file_name=args.data_file,
+                chunk_size=args.chunk_size, backend=args.backend)
     root.mainloop()
 
 
@@ -0,0 +1,307 @@
+"""benchmarks of the order generator, the loaders, the aggregations and
+the chart rendering.
+
+    python main.py run --sizes 10000 1000000 --output new.json
+    python main.py compare old.json new.json --threshold 0.1
+
+every dataset size runs in its own process so that its peak RSS can be
+measured, the results are written as json and two result files can be
+compared with a regression threshold.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = (10000, 1000000, 10000000)
+# orders one shop item can take before its stock runs out, see buy_item
+ORDERS_PER_ITEM = 2000
+# orders per message of the StreamingStats.update benchmark
+STREAM_BATCH_SIZE = 100000
+
+logging.basicConfig(level=logging.INFO)
+
+
+def load_module(name: str, relative_path: str):
+    """import one of the apps, they are all called main.py"""
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def measure(function, repeat: int) -> dict:
+    times = list()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def run_size(size: int, seed: int, repeat: int, data_format: str,
+             work_dir: str) -> dict:
+    """all the benchmarks of one dataset size, runs in a child process"""
+    import matplotlib
+    matplotlib.use("Agg")
+
+    generator = load_module("generator", "information/main.py")
+    customer_app = load_module("customer_app", "ChartsPurchases/main.py")
+    sales_app = load_module("sales_app", "ChartSales/main.py")
+    best_selling = load_module("best_selling",
+                               "BestSellingProducts/main.py")
+    from common.cube import OrderCube
+    from common.options import PARTITION_FORMATS
+    from common.partitions import write_partitioned
+    from common.rendering import (HeadlessRenderer, render_customer,
+                                  render_product)
+    from common.storage import load_orders
+    from common.streaming import (TITLES, OrderPublisher, StreamingStats,
+                                  iter_messages)
+    # keep the load and save messages of the apps out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    timings = dict()
+    items_count = max(1000, size // ORDERS_PER_ITEM)
+    dataset = dict()
+
+    def generate():
+        dataset["items"], dataset["orders"] = generator.generate_dataset(
+            orders_count=size, items_count=items_count, seed=seed)
+
+    timings["generate"] = measure(generate, 1)
+    file_name = os.path.join(work_dir, f"orders-{size}.{data_format}")
+    timings["save"] = measure(
+        lambda: generator.write_orders_frame(dataset["orders"], file_name),
+        1)
+    rows = len(dataset.pop("orders"))
+
+    timings["SalesReport.load_data"] = measure(
+        lambda: best_selling.SalesReport.load_data(file_name), repeat)
+    timings["CustomerApp.load_data"] = measure(
+        lambda: customer_app.CustomerApp.load_data(file_name), repeat)
+    timings["SalesApp.load_data"] = measure(
+        lambda: sales_app.SalesApp.load_data(file_name), repeat)
+
+    # the timed closures read the frames from dataset, which drops them
+    # once they are timed
+    dataset["orders"] = best_selling.SalesReport.load_data(file_name)
+    timings["OrderCube.from_orders"] = measure(
+        lambda: OrderCube.from_orders(dataset["orders"]), repeat)
+    cube = OrderCube.from_orders(dataset["orders"])
+
+    # the orders published in batches and folded into the running report
+    # statistics, as the streaming report does
+    orders = dataset.pop("orders")
+    dataset["published"] = io.BytesIO()
+    publisher = OrderPublisher(dataset["published"])
+    for start in range(0, len(orders), STREAM_BATCH_SIZE):
+        publisher.send(orders.iloc[start:start + STREAM_BATCH_SIZE])
+    publisher.close()
+    del orders
+
+    def consume_stream():
+        published = dataset["published"]
+        published.seek(0)
+        stats = StreamingStats()
+        for kind, payload in iter_messages(published):
+            if kind == TITLES:
+                stats.add_titles(payload)
+            else:
+                stats.update(payload)
+
+    timings["StreamingStats.update"] = measure(consume_stream, repeat)
+    dataset.pop("published")
+
+    # one month of orders, from the whole file and from the month
+    # partitions only
+    month = int(cube.table["month"].iloc[0])
+    timings["load_orders.month"] = measure(
+        lambda: load_orders(file_name, filters={"month": month}), repeat)
+    if data_format in PARTITION_FORMATS:
+        partitioned = os.path.join(work_dir, f"orders-{size}-partitioned")
+        timings["write_partitioned"] = measure(
+            lambda: write_partitioned(file_name, partitioned,
+                                      partition_format=data_format), 1)
+        timings["load_orders.month.partitioned"] = measure(
+            lambda: load_orders(partitioned, filters={"month": month}),
+            repeat)
+        timings["OrderCube.from_file.partitioned"] = measure(
+            lambda: OrderCube.from_file(partitioned, processes=None),
+            repeat)
+
+    report = object.__new__(best_selling.SalesReport)
+    report.cube = cube
+    customers = object.__new__(customer_app.CustomerApp)
+    customers.cube = cube
+    products = object.__new__(sales_app.SalesApp)
+    products.cube = cube
+    customer_id = int(cube.customers()[0])
+    title = str(cube.titles()[0])
+
+    timings["find_most_sales_item"] = measure(
+        report.find_most_sales_item, repeat)
+    items = report.find_most_sales_item()
+
+    def report_per_month():
+        item_stats = report.monthly_stats_of_items(items)
+        for item in items:
+            monthly_stats = item_stats.loc[item]
+            report.sales_per_month(monthly_stats, monthly_stats.index)
+            report.purchase_per_month(monthly_stats, monthly_stats.index)
+
+    def customer_per_month():
+        monthly_stats, item_stats = customers.customer_series(customer_id)
+        customers.order_per_month(monthly_stats, monthly_stats.index)
+        customers.purchase_per_month(monthly_stats, monthly_stats.index)
+        customers.order_per_item(item_stats, item_stats.index)
+
+    timings["SalesReport.per_month"] = measure(report_per_month, repeat)
+    timings["CustomerApp.per_month"] = measure(customer_per_month, repeat)
+    timings["SalesApp.per_month"] = measure(
+        lambda: products.product_series(title), repeat)
+
+    renderer = HeadlessRenderer(os.path.join(work_dir, f"charts-{size}"))
+
+    def render_report():
+        item_stats = report.monthly_stats_of_items(items)
+        axis = renderer.axes(2)
+        report.plot_sales_per_month(items, axis, item_stats)
+        report.plot_purchase_per_month(items, axis, item_stats)
+        renderer.save("report")
+
+    timings["render.customer"] = measure(
+        lambda: render_customer(renderer, cube, customer_id), repeat)
+    timings["render.product"] = measure(
+        lambda: render_product(renderer, cube, title), repeat)
+    timings["render.report"] = measure(render_report, repeat)
+
+    return {"rows": rows, "peak_rss_mb": peak_rss_mb(), "timings": timings}
+
+
+def run(args) -> int:
+    import numpy
+    import pandas
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy.__version__,
+            "pandas": pandas.__version__,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "data_format": args.data_format,
+        },
+        "results": dict(),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for size in args.sizes:
+            logging.info(f"Benchmarking {size} orders")
+            # a fresh process per size, so peak RSS is per size
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_size, size, args.seed,
+                                         args.repeat, args.data_format,
+                                         work_dir).result()
+            results["results"][str(size)] = result
+            for name, timing in result["timings"].items():
+                logging.info(f"{size:>10} {name:<28} {timing['min']:.4f}s")
+            logging.info(f"{size:>10} peak RSS {result['peak_rss_mb']:.0f} MB")
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=4)
+    logging.info(f"Results written to {args.output}")
+    return 0
+
+
+def compare(args) -> int:
+    """exit status 1 if any benchmark of the candidate is slower, or uses
+    more memory, than the baseline by more than the threshold"""
+    with open(args.baseline) as file:
+        baseline = json.load(file)["results"]
+    with open(args.candidate) as file:
+        candidate = json.load(file)["results"]
+    regressions = 0
+    for size, result in candidate.items():
+        if size not in baseline:
+            continue
+        pairs = [(name, baseline[size]["timings"][name]["min"],
+                  timing["min"])
+                 for name, timing in result["timings"].items()
+                 if name in baseline[size]["timings"]]
+        pairs.append(("peak_rss_mb", baseline[size]["peak_rss_mb"],
+                      result["peak_rss_mb"]))
+        for name, old, new in pairs:
+            change = (new - old) / old if old else 0.0
+            is_regression = change > args.threshold
+            regressions += is_regression
+            print(f"{size:>10} {name:<28} {old:>10.4f} {new:>10.4f} "
+                  f"{change:>+8.1%}{'  REGRESSION' if is_regression else ''}")
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--sizes", help="Dataset sizes in orders",
+                            type=int, nargs="+", default=DEFAULT_SIZES)
+    run_parser.add_argument("--seed", help="Generator seed", type=int,
+                            default=0)
+    run_parser.add_argument("--repeat", help="Runs of every benchmark, "
+                                             "the fastest one counts",
+                            type=int, default=3)
+    run_parser.add_argument("--data-format",
+                            help="Extension of the generated orders file",
+                            choices=("json", "jsonl", "parquet", "feather",
+                                     "npz"),
+                            default="npz")
+    run_parser.add_argument("--work-dir",
+                            help="Keep the generated files here instead "
+                                 "of a temporary directory")
+    run_parser.add_argument("--output", help="Results file",
+                            default="benchmark.json")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold",
+                                help="Allowed slowdown, 0.1 is 10%%",
+                                type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = arg_input_parser()
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""code shared by the order generator and the chart apps"""
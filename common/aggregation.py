@@ -0,0 +1,121 @@
+"""order statistics computed in a single pass over the order table
+
+every statistic the charts need is derived from four additive measures:
+the number of order rows, the units sold ("count"), the revenue
+("total_price") and the sum of the unit prices ("price_sum", so that the
+mean price is price_sum / orders).
+"""
+import numpy as np
+import pandas as pd
+
+
+GROUP_KEYS = ["customer_id", "title", "month"]
+MEASURES = ("orders", "count", "total_price", "price_sum")
+
+
+def unit_prices(orders: pd.DataFrame) -> np.ndarray:
+    if "price" in orders.columns:
+        return orders["price"].to_numpy(dtype=np.float64)
+    return (orders["total_price"].to_numpy(dtype=np.float64)
+            / orders["count"].to_numpy(dtype=np.float64))
+
+
+def _key_codes(values: pd.Series):
+    """dense integer codes of a key column and the key of each code"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    if pd.api.types.is_integer_dtype(values.dtype) and len(values):
+        low, high = int(values.min()), int(values.max())
+        if high - low <= max(len(values), 1 << 16):
+            codes = values.to_numpy(dtype=np.int64) - low
+            return codes, pd.RangeIndex(low, high + 1)
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def _bincount(codes: np.ndarray, weights, size: int) -> np.ndarray:
+    sums = np.bincount(codes, weights=weights, minlength=size)
+    if weights is None or pd.api.types.is_integer_dtype(weights.dtype):
+        return sums.astype(np.int64)
+    return sums
+
+
+def _widen(weights, size: int) -> np.ndarray:
+    """64 bit copy of a measure so that sums of downcast columns cannot
+    overflow"""
+    if weights is None:
+        return np.ones(size, dtype=np.int64)
+    if pd.api.types.is_integer_dtype(weights.dtype):
+        return np.asarray(weights, dtype=np.int64)
+    return np.asarray(weights, dtype=np.float64)
+
+
+def _sum_by(keys: pd.DataFrame, by, measures: dict) -> pd.DataFrame:
+    """sum each measure array by one key column or a list of them, a None
+    measure counts the rows instead"""
+    if isinstance(by, str):
+        codes, index = _key_codes(keys[by])
+        stats = pd.DataFrame({
+            name: _bincount(codes, weights, len(index))
+            for name, weights in measures.items()
+        }, index=pd.Index(index, name=by))
+        return stats[stats["orders"] > 0]
+
+    columns = {name: _widen(weights, len(keys))
+               for name, weights in measures.items()}
+    frame = keys[list(by)].assign(**columns)
+    return frame.groupby(list(by), observed=True, sort=True).sum()
+
+
+def aggregate_by(orders: pd.DataFrame, by) -> pd.DataFrame:
+    """the MEASURES of the orders grouped by one column or a list of them.
+
+    a single key column is aggregated with np.bincount, several keys go
+    through one groupby. keys without orders are left out and the result
+    is sorted by key.
+    """
+    return _sum_by(orders, by, {
+        "orders": None,
+        "count": orders["count"].to_numpy(),
+        "total_price": orders["total_price"].to_numpy(),
+        "price_sum": unit_prices(orders),
+    })
+
+
+def aggregate_orders(orders: pd.DataFrame) -> pd.DataFrame:
+    """the MEASURES per (customer_id, title, month)"""
+    return aggregate_by(orders, GROUP_KEYS)
+
+
+def rollup(stats: pd.DataFrame, by) -> pd.DataFrame:
+    """regroup already aggregated rows, keys are columns of stats"""
+    return _sum_by(stats, by, {
+        measure: stats[measure].to_numpy() for measure in MEASURES
+    })
+
+
+def merge_aggregates(parts: list, by) -> pd.DataFrame:
+    """fold partial aggregates (keys as columns) into one, e.g. the
+    aggregates of the chunks of a file too big to load at once"""
+    return rollup(pd.concat(parts, ignore_index=True), by)
+
+
+def top_k(values: pd.Series, k: int) -> pd.Series:
+    """the k largest values, largest first and ties ordered by key.
+
+    instead of sorting every value, a partial selection (np.partition)
+    finds the k-th largest value and only the values reaching it are
+    sorted.
+    """
+    if k <= 0:
+        return values.iloc[:0]
+    if k < len(values):
+        data = values.to_numpy()
+        threshold = np.partition(data, len(data) - k)[len(data) - k]
+        values = values[data >= threshold]
+    values = values.sort_index().sort_values(ascending=False, kind="stable")
+    return values.iloc[:k]
+
+
+def mean_price(stats: pd.DataFrame) -> pd.Series:
+    return stats["price_sum"] / stats["orders"]
@@ -0,0 +1,87 @@
+"""render the charts of many customers or products with a process pool.
+
+the cube is handed to the workers when the pool starts. with the fork
+start method (the default on linux) the workers inherit it from the
+parent process and share its memory copy-on-write instead of receiving
+a pickled copy. every worker keeps its own HeadlessRenderer.
+"""
+import logging
+import multiprocessing
+import os
+import time
+
+from common.rendering import (HeadlessRenderer, render_all, render_customer,
+                              render_product)
+
+
+RENDERERS = {
+    "customer": render_customer,
+    "product": render_product,
+}
+
+# per worker state, set by _init_worker
+_worker = dict()
+
+
+def _init_worker(kind: str, cube, output_dir: str, image_format: str):
+    _worker["render"] = RENDERERS[kind]
+    _worker["cube"] = cube
+    _worker["renderer"] = HeadlessRenderer(output_dir,
+                                           image_format=image_format)
+
+
+def _render_keys(keys: list) -> tuple:
+    paths = render_all(_worker["render"], _worker["renderer"],
+                       _worker["cube"], keys)
+    return len(keys), len(paths)
+
+
+def _chunks(keys: list, chunk_size: int):
+    for start in range(0, len(keys), chunk_size):
+        yield keys[start:start + chunk_size]
+
+
+def render_in_parallel(kind: str, cube, keys, output_dir: str,
+                       image_format: str = "png", processes: int = None,
+                       chunk_size: int = None) -> int:
+    """render the charts of every key, kind is "customer" or "product".
+
+    progress and throughput are logged as chunks of keys complete, the
+    number of written image files is returned.
+    """
+    keys = list(keys)
+    processes = processes or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(64, len(keys) // (processes * 4)))
+    started = time.perf_counter()
+    done = written = 0
+
+    def report():
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0.0
+        logging.info(f"{done}/{len(keys)} {kind}s rendered, "
+                     f"{written} charts, {rate:.1f} {kind}s/s")
+
+    if processes == 1:
+        _init_worker(kind, cube, output_dir, image_format)
+        for chunk in _chunks(keys, chunk_size):
+            rendered, paths = _render_keys(chunk)
+            done += rendered
+            written += paths
+            report()
+        return written
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with context.Pool(processes=processes,
+                      initializer=_init_worker,
+                      initargs=(kind, cube, output_dir, image_format),
+                      ) as pool:
+        for rendered, paths in pool.imap_unordered(
+                _render_keys, _chunks(keys, chunk_size)):
+            done += rendered
+            written += paths
+            report()
+    return written
@@ -0,0 +1,160 @@
+"""small in-memory caches, and a size-bounded cache of results on disk"""
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+
+from common.options import DEFAULT_DISK_CACHE_BYTES
+
+
+# part of every DiskCache key, bump it when the cached results change
+DISK_CACHE_VERSION = 1
+# the files of DiskCache entries, a key and a suffix. other files in the
+# directory are never evicted
+DISK_CACHE_FILE = re.compile(r"[0-9a-f]{40}\.[0-9A-Za-z]+")
+
+
+class LRUCache:
+    """mapping that keeps at most maxsize entries and drops the least
+    recently used one first"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    """results saved as files in directory, one or more files per key.
+
+    a key is a hash of the fingerprint of the input data and of the
+    parameters the result was computed with, so a changed input simply
+    misses. reading an entry marks it as recently used, and once the
+    entry files take more than max_bytes the least recently used entries
+    are deleted. a result larger than max_bytes is not stored.
+    """
+
+    def __init__(self, directory: str,
+                 max_bytes: int = DEFAULT_DISK_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(fingerprint: tuple, **params) -> str:
+        data = json.dumps([DISK_CACHE_VERSION, list(fingerprint), params],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _hit(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        # the modification time is the last use for the eviction
+        os.utime(path)
+        return True
+
+    def get_frame(self, key: str):
+        """the frame saved under key, or None"""
+        path = self.path(key, ".npz")
+        if not self._hit(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                index_columns = list(arrays["index_columns"])
+                columns = {str(column): arrays[f"column.{column}"]
+                           for column in arrays["columns"]}
+        except (OSError, KeyError, ValueError):
+            return None
+        frame = pd.DataFrame(columns)
+        return frame.set_index(index_columns) if index_columns else frame
+
+    def put_frame(self, key: str, frame: pd.DataFrame):
+        index_columns = [name for name in frame.index.names
+                         if name is not None]
+        if index_columns:
+            frame = frame.reset_index()
+        arrays = {"columns": frame.columns.to_numpy(dtype=str),
+                  "index_columns": np.array(index_columns, dtype=str)}
+        for column in frame.columns:
+            values = frame[column]
+            if pd.api.types.is_numeric_dtype(values.dtype):
+                arrays[f"column.{column}"] = values.to_numpy()
+            else:
+                arrays[f"column.{column}"] = values.to_numpy(dtype=str)
+        self._write(self.path(key, ".npz"),
+                    lambda file: np.savez(file, **arrays))
+
+    def get_file(self, key: str, suffix: str):
+        """the path of the file saved under key, or None"""
+        path = self.path(key, suffix)
+        return path if self._hit(path) else None
+
+    def put_file(self, key: str, source: str):
+        def copy(file):
+            with open(source, "rb") as source_file:
+                shutil.copyfileobj(source_file, file)
+
+        self._write(self.path(key, os.path.splitext(source)[1]), copy)
+
+    def _write(self, path: str, write):
+        """write through a temporary file, a failed write is logged and
+        leaves the cache as it was"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as file:
+                write(file)
+            size = os.path.getsize(temp_path)
+            if size > self.max_bytes:
+                os.remove(temp_path)
+                logging.info(f"Result not cached: {size} bytes is over the "
+                             f"{self.max_bytes} bytes cache limit")
+                return
+            os.replace(temp_path, path)
+            self.evict(keep=path)
+        except OSError as e:
+            logging.warning(f"Result not cached: {e}")
+
+    def evict(self, keep: str = None):
+        """delete the least recently used entry files until they fit in
+        max_bytes, never the file keep that was just written"""
+        entries = list()
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and DISK_CACHE_FILE.fullmatch(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
@@ -0,0 +1,225 @@
+"""materialized order statistics per (customer_id, title, month)"""
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from common.aggregation import (GROUP_KEYS, MEASURES, aggregate_orders,
+                                merge_aggregates, rollup, top_k)
+from common.index import OrderIndex
+from common.options import RANKINGS
+from common.partitions import aggregate_shards
+from common.storage import (DEFAULT_CHUNK_SIZE, file_fingerprint,
+                            file_format, iter_orders)
+
+
+# chunk aggregates buffered by from_file before they are merged
+MERGE_EVERY = 16
+# the cube and its index are saved next to the orders file with this suffix
+CUBE_FILE_SUFFIX = ".cube.npz"
+
+
+def cube_file_name(file_name: str, filters: dict = None) -> str:
+    """where the cube of file_name is saved, the cube of the orders
+    matching filters has a file of its own, e.g. orders.month=3.cube.npz"""
+    keys = "".join(f".{column}={value}"
+                   for column, value in sorted((filters or dict()).items())
+                   if value is not None)
+    # no trailing separator, the cube of a dataset directory is saved
+    # next to it
+    return os.path.normpath(file_name) + keys + CUBE_FILE_SUFFIX
+
+
+class OrderCube:
+    """aggregate_orders of all the orders seen so far.
+
+    the cube is built once from the order table, later batches of orders
+    are folded in with append. all queries read the cube rows only, which
+    are at most customers x titles x 12 and usually far fewer than the
+    order rows, and customer or title lookups go through an OrderIndex of
+    the cube rows so they only touch the matching rows.
+    """
+
+    def __init__(self, table: pd.DataFrame = None, index: OrderIndex = None):
+        if table is None:
+            table = pd.DataFrame(columns=GROUP_KEYS + list(MEASURES))
+        self.table = table
+        self._index = index
+        # bumped by append so callers can drop results computed earlier
+        self.version = 0
+
+    @classmethod
+    def from_orders(cls, orders: pd.DataFrame):
+        return cls(cls._to_table(aggregate_orders(orders)))
+
+    @classmethod
+    def from_file(cls, file_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  memory_map: bool = False, progress=None,
+                  filters: dict = None, processes: int = 1):
+        """build the cube reading chunk_size orders at a time.
+
+        only the cube and one chunk are held in memory, so the order file
+        may be larger than RAM as long as its format can be read in
+        chunks (see storage.iter_orders). progress is called with the
+        fraction of the file read after every chunk. with filters the
+        cube only holds the matching orders. the shards of a dataset
+        directory are aggregated by processes processes at once, None
+        for one per CPU, and progress is then called per shard.
+        """
+        if processes != 1 and file_format(file_name) == "manifest":
+            stats = aggregate_shards(file_name, filters=filters,
+                                     processes=processes,
+                                     chunk_size=chunk_size,
+                                     memory_map=memory_map,
+                                     progress=progress)
+            return cls() if stats is None else cls(cls._to_table(stats))
+        parts = list()
+        for chunk, fraction in iter_orders(file_name, chunk_size=chunk_size,
+                                           memory_map=memory_map,
+                                           filters=filters):
+            parts.append(aggregate_orders(chunk).reset_index())
+            if len(parts) >= MERGE_EVERY:
+                parts = [merge_aggregates(parts, GROUP_KEYS).reset_index()]
+            if progress is not None:
+                progress(fraction)
+        if not parts:
+            return cls()
+        return cls(cls._to_table(merge_aggregates(parts, GROUP_KEYS)))
+
+    @classmethod
+    def cached(cls, file_name: str, build, filters: dict = None):
+        """the cube saved next to file_name if it was built from the file
+        as it is now, otherwise build() which is then saved there. a cube
+        built from the orders matching filters is saved under its own
+        name, so it is never taken for the cube of the whole file"""
+        saved_file_name = cube_file_name(file_name, filters)
+        fingerprint = file_fingerprint(file_name)
+        cube = cls.load(saved_file_name, fingerprint)
+        if cube is not None:
+            logging.info(f"Order cube loaded from {saved_file_name}")
+            return cube
+        cube = build()
+        try:
+            cube.save(saved_file_name, fingerprint)
+        except OSError as e:
+            logging.warning(f"Order cube not saved: {e}")
+        return cube
+
+    def save(self, file_name: str, fingerprint: tuple):
+        if self.table.empty:
+            return
+        arrays = {
+            "fingerprint": np.array(fingerprint, dtype=np.int64),
+            "columns": self.table.columns.to_numpy(dtype=str),
+        }
+        for column in self.table.columns:
+            values = self.table[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                arrays[f"table.{column}.codes"] = values.cat.codes.to_numpy()
+                arrays[f"table.{column}.categories"] = (
+                    values.cat.categories.to_numpy(dtype=str))
+            else:
+                arrays[f"table.{column}"] = values.to_numpy()
+        arrays.update(self.index.to_arrays())
+        np.savez(file_name, **arrays)
+
+    @classmethod
+    def load(cls, file_name: str, fingerprint: tuple):
+        """the saved cube, or None if it is missing, unreadable or was
+        built from a different version of the orders file"""
+        try:
+            with np.load(file_name, allow_pickle=False) as arrays:
+                if tuple(arrays["fingerprint"]) != tuple(fingerprint):
+                    return None
+                columns = dict()
+                for column in arrays["columns"]:
+                    if f"table.{column}.codes" in arrays.files:
+                        columns[column] = pd.Categorical.from_codes(
+                            arrays[f"table.{column}.codes"],
+                            categories=arrays[f"table.{column}.categories"])
+                    else:
+                        columns[column] = arrays[f"table.{column}"]
+                index = OrderIndex.from_arrays(arrays)
+        except (OSError, KeyError, ValueError):
+            return None
+        return cls(pd.DataFrame(columns), index=index)
+
+    @staticmethod
+    def _to_table(stats: pd.DataFrame) -> pd.DataFrame:
+        table = stats.reset_index()
+        table["title"] = table["title"].astype("category")
+        return table
+
+    def append(self, orders: pd.DataFrame):
+        """fold a batch of new orders into the cube"""
+        if orders.empty:
+            return
+        batch = aggregate_orders(orders).reset_index()
+        if self.table.empty:
+            merged = rollup(batch, GROUP_KEYS)
+        else:
+            merged = merge_aggregates([self.table, batch], GROUP_KEYS)
+        self.table = self._to_table(merged)
+        self._index = None
+        self.version += 1
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def empty(self) -> bool:
+        return self.table.empty
+
+    @property
+    def orders_count(self) -> int:
+        return int(self.table["orders"].sum())
+
+    @property
+    def index(self) -> OrderIndex:
+        if self._index is None:
+            self._index = OrderIndex.build(self.table)
+        return self._index
+
+    def _select(self, customer_id=None, title=None,
+                month=None) -> pd.DataFrame:
+        positions = None
+        for column, key in (("customer_id", customer_id), ("title", title)):
+            if key is None:
+                continue
+            key_rows = self.index.rows(column, key)
+            if positions is None:
+                positions = key_rows
+            else:
+                positions = np.intersect1d(positions, key_rows,
+                                           assume_unique=True)
+        rows = self.table if positions is None else self.table.iloc[positions]
+        if month is not None:
+            rows = rows[rows["month"] == month]
+        return rows
+
+    def monthly(self, customer_id=None, title=None) -> pd.DataFrame:
+        """the MEASURES per month, optionally for one customer or title"""
+        return rollup(self._select(customer_id=customer_id, title=title),
+                      "month")
+
+    def per_title(self, customer_id=None, month=None) -> pd.DataFrame:
+        """the MEASURES per title, optionally for one customer or month"""
+        return rollup(self._select(customer_id=customer_id, month=month),
+                      "title")
+
+    def top_titles(self, k: int = 5, by: str = "units", month=None,
+                   customer_id=None) -> pd.Series:
+        """the k best selling titles ranked by units sold or revenue"""
+        stats = self.per_title(customer_id=customer_id, month=month)
+        return top_k(stats[RANKINGS[by]], k)
+
+    def monthly_per_title(self, titles: list) -> pd.DataFrame:
+        """the MEASURES per (title, month) of the given titles"""
+        rows = self.table[self.table["title"].isin(titles)]
+        return rollup(rows, ["title", "month"])
+
+    def customers(self) -> pd.Index:
+        return pd.Index(self.table["customer_id"].unique()).sort_values()
+
+    def titles(self) -> pd.Index:
+        return pd.Index(self.table["title"].unique()).sort_values()
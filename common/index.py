@@ -0,0 +1,86 @@
+"""secondary indexes mapping a key to the positions of its rows"""
+import numpy as np
+import pandas as pd
+
+
+class KeyIndex:
+    """CSR layout: the sorted distinct keys, and for the i-th key its row
+    positions are positions[offsets[i]:offsets[i + 1]], ascending"""
+
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray,
+                 positions: np.ndarray):
+        self.keys = keys
+        self.offsets = offsets
+        self.positions = positions
+
+    @classmethod
+    def build(cls, values):
+        codes, uniques = pd.factorize(values)
+        # sort the keys by value (a categorical would keep its category
+        # order) so that they can be binary searched
+        keys = np.asarray(uniques)
+        order = np.argsort(keys, kind="stable")
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        codes = ranks[codes]
+        positions = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(keys))
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(keys[order], offsets, positions)
+
+    def _find(self, key) -> int:
+        try:
+            i = int(np.searchsorted(self.keys, key))
+        except (TypeError, OverflowError):
+            return -1
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def rows(self, key) -> np.ndarray:
+        """row positions of key, empty when the key is unknown"""
+        i = self._find(key)
+        if i < 0:
+            return self.positions[:0]
+        return self.positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class OrderIndex:
+    """KeyIndex of the customer_id and title columns of a table"""
+    COLUMNS = ("customer_id", "title")
+
+    def __init__(self, indexes: dict):
+        self.indexes = indexes
+
+    @classmethod
+    def build(cls, table: pd.DataFrame):
+        return cls({column: KeyIndex.build(table[column])
+                    for column in cls.COLUMNS})
+
+    def rows(self, column: str, key) -> np.ndarray:
+        return self.indexes[column].rows(key)
+
+    def to_arrays(self) -> dict:
+        arrays = dict()
+        for column, index in self.indexes.items():
+            keys = index.keys
+            if keys.dtype == object:
+                keys = keys.astype(str)
+            arrays[f"{column}.keys"] = keys
+            arrays[f"{column}.offsets"] = index.offsets
+            arrays[f"{column}.positions"] = index.positions
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls({column: KeyIndex(arrays[f"{column}.keys"],
+                                     arrays[f"{column}.offsets"],
+                                     arrays[f"{column}.positions"])
+                    for column in cls.COLUMNS})
@@ -0,0 +1,193 @@
+"""per function call statistics.
+
+instrument is off unless the ORDERS_INSTRUMENT environment variable is
+set when the module is imported, or enable() is called before the
+instrumented modules are imported. while off it returns the function
+unchanged, so it costs nothing per call.
+
+    ORDERS_INSTRUMENT=table   log a summary table at exit (also 1)
+    ORDERS_INSTRUMENT=json    write the summary as json at exit
+    ORDERS_INSTRUMENT_OUTPUT  json file, defaults to instrumentation.json
+    ORDERS_INSTRUMENT_MEMORY  set to 1 to also record tracemalloc deltas
+
+an unknown ORDERS_INSTRUMENT value is logged and leaves it off. memory
+stays bounded however long a process runs: every function keeps its
+call count, total, min and max, and a fixed size random sample of its
+durations for the percentiles.
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+
+ENV_VARIABLE = "ORDERS_INSTRUMENT"
+OUTPUT_ENV_VARIABLE = "ORDERS_INSTRUMENT_OUTPUT"
+MEMORY_ENV_VARIABLE = "ORDERS_INSTRUMENT_MEMORY"
+DEFAULT_OUTPUT = "instrumentation.json"
+REPORT_FORMATS = ("table", "json")
+# durations kept per function for the percentiles
+SAMPLE_SIZE = 1024
+
+_settings = {"report": None, "memory": False, "output": DEFAULT_OUTPUT}
+# function name -> CallStats of its durations in seconds
+_durations = dict()
+# function name -> CallStats of its traced memory deltas in bytes
+_memory = dict()
+
+
+class CallStats:
+    """count, sum, min and max of a series of values, and a uniform
+    sample of at most SAMPLE_SIZE of them (reservoir sampling)"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.sample = list()
+        self._random = random.Random(0)
+
+    def append(self, value: float):
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample.append(value)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < SAMPLE_SIZE:
+                self.sample[slot] = value
+
+
+def enabled() -> bool:
+    return _settings["report"] is not None
+
+
+def enable(report: str = "table", memory: bool = False,
+           output: str = DEFAULT_OUTPUT):
+    """only functions decorated after this call are instrumented"""
+    if report not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {report}")
+    first = not enabled()
+    _settings.update(report=report, memory=memory, output=output)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if first:
+        atexit.register(dump)
+
+
+def instrument(func):
+    if not enabled():
+        return func
+    name = func.__qualname__
+    durations = _durations.setdefault(name, CallStats())
+    if not _settings["memory"]:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - started)
+        return wrapper
+
+    deltas = _memory.setdefault(name, CallStats())
+
+    @functools.wraps(func)
+    def memory_wrapper(*args, **kwargs):
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - started)
+            deltas.append(tracemalloc.get_traced_memory()[0] - memory_before)
+    return memory_wrapper
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary() -> list:
+    """one dict per called function, slowest cumulative time first"""
+    rows = list()
+    for name, durations in _durations.items():
+        if not durations.count:
+            continue
+        ordered = sorted(durations.sample)
+        row = {"function": name,
+               "calls": durations.count,
+               "total_s": durations.total,
+               "min_ms": durations.minimum * 1000,
+               "p50_ms": _percentile(ordered, 0.5) * 1000,
+               "p99_ms": _percentile(ordered, 0.99) * 1000,
+               "max_ms": durations.maximum * 1000}
+        if name in _memory:
+            row["memory_delta_kib"] = _memory[name].total / 2 ** 10
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+
+def format_table(rows: list) -> str:
+    lines = [f"{'function':<40} {'calls':>10} {'total s':>10} "
+             f"{'p50 ms':>10} {'p99 ms':>10} {'mem KiB':>10}"]
+    for row in rows:
+        memory = row.get("memory_delta_kib")
+        lines.append(f"{row['function']:<40} {row['calls']:>10} "
+                     f"{row['total_s']:>10.4f} {row['p50_ms']:>10.4f} "
+                     f"{row['p99_ms']:>10.4f} "
+                     f"{'' if memory is None else f'{memory:.1f}':>10}")
+    return "\n".join(lines)
+
+
+def dump():
+    rows = summary()
+    if not rows:
+        return
+    if _settings["report"] == "json":
+        with open(_settings["output"], "w") as outfile:
+            json.dump(rows, outfile, indent=4)
+        logging.info(f"Instrumentation written to {_settings['output']}")
+    else:
+        logging.info("Instrumentation\n" + format_table(rows))
+
+
+def reset():
+    for durations in _durations.values():
+        durations.reset()
+    for deltas in _memory.values():
+        deltas.reset()
+
+
+def _enable_from_environment():
+    """enable() as asked by ORDERS_INSTRUMENT, a bad value must not stop
+    the tools from starting"""
+    report = os.environ.get(ENV_VARIABLE, "").strip().lower()
+    if report in ("", "0"):
+        return
+    if report == "1":
+        report = "table"
+    if report not in REPORT_FORMATS:
+        # not the root logger, that would configure it before the tools
+        logging.getLogger(__name__).warning(
+            f"{ENV_VARIABLE}={report} is not one of 1, "
+            f"{', '.join(REPORT_FORMATS)}, instrumentation is off")
+        return
+    memory = os.environ.get(MEMORY_ENV_VARIABLE, "").strip()
+    enable(report=report, memory=memory not in ("", "0"),
+           output=os.environ.get(OUTPUT_ENV_VARIABLE) or DEFAULT_OUTPUT)
+
+
+_enable_from_environment()
@@ -0,0 +1,342 @@
+"""the command line arguments of the tools, and the choices and defaults
+they offer.
+
+only argparse is imported here, so that the tools and the launcher can
+parse their arguments, print --help or reject a bad option before numpy,
+pandas or matplotlib are loaded. the modules these constants belong to
+import them from here.
+"""
+import argparse
+
+
+FILE_ADDRESS = "../../1/1/sample.json"
+DEFAULT_CHUNK_SIZE = 1000000
+DEFAULT_DISK_CACHE_BYTES = 64 * 2 ** 20
+# report results are cached in this directory next to the orders file
+REPORT_CACHE_DIR = ".report-cache"
+# ranking measures of the best sellers report
+RANKINGS = {"units": "count", "revenue": "total_price"}
+# the query engines the apps can be started with
+BACKENDS = ("cube", "sqlite")
+IMAGE_FORMATS = ("png", "svg")
+# formats keeping the order index, so the partitions need no index_start
+PARTITION_FORMATS = ("npz", "parquet", "feather")
+PROFILE_NAMES = ("uniform", "zipf", "seasonal", "bursty")
+ENGINES = ("vectorized", "objects")
+VERBOSITIES = ("quiet", "debug")
+SHARD_FORMATS = ("json", "jsonl", "parquet", "feather", "npz")
+
+
+def add_data_arguments(parser: argparse.ArgumentParser):
+    """where the orders are read from and how they are queried"""
+    parser.add_argument("--data-file",
+                        help="Orders file",
+                        default=FILE_ADDRESS,
+                        )
+    parser.add_argument("--chunk-size",
+                        help="Stream the orders file this many rows at a "
+                             "time and keep only the aggregates in memory",
+                        type=int,
+                        )
+    parser.add_argument("--backend",
+                        help="Query engine, the in-memory order cube or "
+                             "a SQLite copy of the orders",
+                        choices=BACKENDS,
+                        default="cube",
+                        )
+
+
+def check_data_arguments(parser: argparse.ArgumentParser,
+                         args: argparse.Namespace):
+    # a chunk size of 0 would silently load the whole file instead
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+
+def add_generate_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--orders",
+                        help="Number of orders to draw, orders of sold out "
+                             "items are dropped. Defaults to a random "
+                             "number between 1500 and 2000",
+                        type=int,
+                        )
+    parser.add_argument("--items",
+                        help="Number of shop items",
+                        type=int,
+                        default=1000,
+                        )
+    parser.add_argument("--profile",
+                        help="How customers and shop items are drawn: "
+                             "uniform, zipf (a few hot customers and "
+                             "items), seasonal (peak months) or bursty "
+                             "(zipf with runs of one hot item)",
+                        choices=PROFILE_NAMES,
+                        default="uniform",
+                        )
+    parser.add_argument("--customers",
+                        help="Number of distinct customers",
+                        type=int,
+                        default=10,
+                        )
+    parser.add_argument("--titles",
+                        help="Number of distinct product titles",
+                        type=int,
+                        default=20,
+                        )
+    parser.add_argument("--seed",
+                        help="Random seed, the same seed gives the same "
+                             "orders",
+                        type=int,
+                        )
+    parser.add_argument("--output",
+                        help="Orders file, .json, .jsonl, .parquet, "
+                             ".feather or .npz",
+                        default="sample.json",
+                        )
+    parser.add_argument("--engine",
+                        help="vectorized draws the orders as numpy arrays, "
+                             "objects builds a StoreOrder per order",
+                        choices=ENGINES,
+                        default="vectorized",
+                        )
+    parser.add_argument("--shards",
+                        help="Split the orders into this many shards drawn "
+                             "in parallel, --output is then a directory "
+                             "holding the shard files and their manifest",
+                        type=int,
+                        )
+    parser.add_argument("--processes",
+                        help="Number of processes drawing shards, "
+                             "defaults to the number of CPUs",
+                        type=int,
+                        )
+    parser.add_argument("--shard-format",
+                        help="File format of the shards",
+                        choices=SHARD_FORMATS,
+                        default="npz",
+                        )
+    parser.add_argument("--partition",
+                        help="Write one file per month of every shard, "
+                             "--output is then a directory. queries for "
+                             "one month only read its files",
+                        action="store_true",
+                        )
+    parser.add_argument("--customer-buckets",
+                        help="With --partition, also split every month "
+                             "into this many buckets of customer ids",
+                        type=int,
+                        default=1,
+                        )
+    parser.add_argument("--stream",
+                        help="Publish the orders to a running report "
+                             "instead of writing --output: - for stdout, "
+                             "or the host:port the report listens on",
+                        )
+    parser.add_argument("--batch-size",
+                        help="Orders drawn and published at a time with "
+                             "--stream",
+                        type=int,
+                        default=100000,
+                        )
+    parser.add_argument("--verbosity",
+                        help="quiet only logs a summary, debug also dumps "
+                             "every --sample-every-th item and order",
+                        choices=VERBOSITIES,
+                        default="quiet",
+                        )
+    parser.add_argument("--sample-every",
+                        help="Dump one object out of this many in debug "
+                             "mode",
+                        type=int,
+                        default=100,
+                        )
+
+
+def check_generate_arguments(parser: argparse.ArgumentParser,
+                             args: argparse.Namespace):
+    if args.sample_every < 1:
+        parser.error("--sample-every must be at least 1")
+    if args.customers < 1 or args.titles < 1:
+        parser.error("--customers and --titles must be at least 1")
+    if args.titles > args.items:
+        parser.error(f"--titles {args.titles} needs at least as many "
+                     f"--items, one per title, not {args.items}")
+    if args.engine != "vectorized" and (args.profile != "uniform"
+                                        or args.customers != 10
+                                        or args.titles != 20):
+        parser.error("--profile, --customers and --titles need the "
+                     "vectorized engine")
+    if args.shards is not None:
+        if args.shards < 1:
+            parser.error("--shards must be at least 1")
+        if args.engine != "vectorized":
+            parser.error("--shards needs the vectorized engine")
+        if args.verbosity == "debug":
+            parser.error("--verbosity debug is not supported with --shards")
+    if args.partition and args.shard_format not in PARTITION_FORMATS:
+        parser.error(f"--partition needs a --shard-format out of "
+                     f"{', '.join(PARTITION_FORMATS)}")
+    if args.customer_buckets < 1:
+        parser.error("--customer-buckets must be at least 1")
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.stream is not None:
+        if args.engine != "vectorized":
+            parser.error("--stream needs the vectorized engine")
+        if args.shards is not None or args.partition:
+            parser.error("--stream cannot be combined with --shards or "
+                         "--partition")
+        if args.verbosity == "debug":
+            parser.error("--verbosity debug is not supported with --stream")
+        if args.batch_size < 1:
+            parser.error("--batch-size must be at least 1")
+
+
+def add_render_arguments(parser: argparse.ArgumentParser, key: str,
+                         key_type=str):
+    """render the charts of some or all of the keys to files instead of
+    opening the window, key is "customer" or "product" """
+    parser.add_argument("--output-dir",
+                        help=f"Write the charts of --{key} or --all to "
+                             "this directory instead of opening the window",
+                        )
+    parser.add_argument(f"--{key}",
+                        help=f"{key.capitalize()} "
+                             f"{'codes' if key_type is int else 'names'} "
+                             "to render",
+                        type=key_type,
+                        nargs="+",
+                        default=list(),
+                        )
+    parser.add_argument("--all",
+                        help=f"Render the charts of every {key}",
+                        action="store_true",
+                        )
+    parser.add_argument("--processes",
+                        help="Number of rendering processes, "
+                             "defaults to the number of CPUs",
+                        type=int,
+                        )
+    parser.add_argument("--image-format",
+                        help="Image file format",
+                        choices=IMAGE_FORMATS,
+                        default="png",
+                        )
+
+
+def check_render_arguments(parser: argparse.ArgumentParser,
+                           args: argparse.Namespace, key: str):
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.output_dir and not (getattr(args, key) or args.all):
+        parser.error(f"--output-dir needs --{key} or --all")
+
+
+def add_customer_arguments(parser: argparse.ArgumentParser):
+    add_data_arguments(parser)
+    add_render_arguments(parser, "customer", key_type=int)
+
+
+def check_customer_arguments(parser: argparse.ArgumentParser,
+                             args: argparse.Namespace):
+    check_data_arguments(parser, args)
+    check_render_arguments(parser, args, "customer")
+
+
+def add_product_arguments(parser: argparse.ArgumentParser):
+    add_data_arguments(parser)
+    add_render_arguments(parser, "product")
+
+
+def check_product_arguments(parser: argparse.ArgumentParser,
+                            args: argparse.Namespace):
+    check_data_arguments(parser, args)
+    check_render_arguments(parser, args, "product")
+
+
+def add_report_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-r",
+                        "--report",
+                        help="Report",
+                        action='store_true',
+                        )
+    parser.add_argument("--top-k",
+                        help="Number of best selling items",
+                        type=int,
+                        default=5,
+                        )
+    parser.add_argument("--by",
+                        help="Rank items by units sold or revenue",
+                        choices=sorted(RANKINGS),
+                        default="units",
+                        )
+    parser.add_argument("--month",
+                        help="Rank items by the sales of one month",
+                        type=int,
+                        choices=range(1, 13),
+                        metavar="{1..12}",
+                        )
+    add_data_arguments(parser)
+    parser.add_argument("--processes",
+                        help="Number of processes aggregating the "
+                             "shards of a dataset directory, defaults "
+                             "to the number of CPUs",
+                        type=int,
+                        )
+    parser.add_argument("--output-dir",
+                        help="Write the report image to this directory "
+                             "instead of showing it",
+                        )
+    parser.add_argument("--stream",
+                        help="Report on the orders published by the "
+                             "generator while they arrive: - for stdin, "
+                             "or the host:port to listen on",
+                        )
+    parser.add_argument("--refresh",
+                        help="Seconds between two redraws of the "
+                             "--stream report",
+                        type=float,
+                        default=1.0,
+                        )
+    parser.add_argument("--capacity",
+                        help="Number of titles the --stream report keeps "
+                             "track of, the best sellers are exact when "
+                             "there are fewer titles",
+                        type=int,
+                        default=256,
+                        )
+    parser.add_argument("--image-format",
+                        help="Report image file format",
+                        choices=IMAGE_FORMATS,
+                        default="png",
+                        )
+    parser.add_argument("--cache-dir",
+                        help="Result cache directory, defaults to "
+                             f"{REPORT_CACHE_DIR} next to the orders "
+                             "file",
+                        )
+    parser.add_argument("--cache-size",
+                        help="Result cache size limit in MiB",
+                        type=float,
+                        default=DEFAULT_DISK_CACHE_BYTES / 2 ** 20,
+                        )
+    parser.add_argument("--no-cache",
+                        help="Always recompute the report",
+                        action="store_true",
+                        )
+
+
+def check_report_arguments(parser: argparse.ArgumentParser,
+                           args: argparse.Namespace):
+    check_data_arguments(parser, args)
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.stream is not None:
+        if args.month is not None:
+            parser.error("--month is not supported with --stream")
+        if args.capacity < args.top_k:
+            parser.error("--capacity must be at least --top-k")
+        if args.refresh <= 0:
+            parser.error("--refresh must be positive")
@@ -0,0 +1,181 @@
+"""month partitioned order datasets.
+
+a partitioned dataset is a dataset directory (see storage.write_manifest)
+whose shards each hold the orders of one month and, optionally, of one
+bucket of customer ids (customer_id % customer_buckets):
+
+    month=03/bucket-000-part-00000.npz
+
+the manifest entry of every shard has its month, bucket, row count and
+the min and max of STATS_COLUMNS, so a query for one month or customer
+only opens the shards that can hold its orders. aggregate_shards
+aggregates the shards in parallel and merges the results.
+"""
+import logging
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+from common.aggregation import GROUP_KEYS, aggregate_orders, merge_aggregates
+from common.options import PARTITION_FORMATS
+from common.storage import (DEFAULT_CHUNK_SIZE, concat_orders, iter_orders,
+                            read_manifest, save_orders, select_shards,
+                            write_manifest)
+
+
+STATS_COLUMNS = ("customer_id", "month")
+
+
+def column_stats(orders: pd.DataFrame) -> dict:
+    return {
+        "min": {column: int(orders[column].min())
+                for column in STATS_COLUMNS},
+        "max": {column: int(orders[column].max())
+                for column in STATS_COLUMNS},
+    }
+
+
+def partition_groups(orders: pd.DataFrame, customer_buckets: int = 1):
+    """yield (month, bucket, orders) for every partition holding orders"""
+    months = orders["month"].to_numpy(dtype=np.int64)
+    customer_ids = orders["customer_id"].to_numpy(dtype=np.int64)
+    keys = months * customer_buckets + customer_ids % customer_buckets
+    # a stable sort keeps the order of the rows within a partition
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.diff(sorted_keys, prepend=-1))
+    ends = np.append(starts[1:], len(sorted_keys))
+    for start, end in zip(starts, ends):
+        month, bucket = divmod(int(sorted_keys[start]), customer_buckets)
+        yield month, bucket, orders.iloc[order[start:end]]
+
+
+def write_partition(orders: pd.DataFrame, directory: str, month: int,
+                    bucket: int, part: str,
+                    partition_format: str = "npz") -> dict:
+    """save the orders of one partition, returns its manifest entry. the
+    partition is not logged, a dataset has hundreds of them"""
+    file = os.path.join(f"month={month:02d}",
+                        f"bucket-{bucket:03d}-part-{part}."
+                        f"{partition_format}")
+    os.makedirs(os.path.join(directory, os.path.dirname(file)),
+                exist_ok=True)
+    save_orders(orders, os.path.join(directory, file), report=False)
+    return dict(column_stats(orders), file=file, rows=len(orders),
+                month=month, bucket=bucket)
+
+
+def partition_frame(orders: pd.DataFrame, directory: str, part: str,
+                    customer_buckets: int = 1,
+                    partition_format: str = "npz") -> list:
+    """write every partition of the orders, returns their manifest
+    entries. part tells apart the files of different calls"""
+    return [write_partition(partition, directory, month, bucket, part,
+                            partition_format=partition_format)
+            for month, bucket, partition in partition_groups(
+                orders, customer_buckets)]
+
+
+def write_partitioned(file_name: str, directory: str,
+                      customer_buckets: int = 1,
+                      partition_format: str = "npz",
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """copy an order file or dataset into a partitioned dataset.
+
+    the file is read chunk_size orders at a time and every partition is
+    buffered until it holds chunk_size orders, so at most one chunk per
+    partition is held in memory. returns the number of orders written.
+    """
+    if partition_format not in PARTITION_FORMATS:
+        raise ValueError(f"Unsupported partition format: {partition_format}")
+    os.makedirs(directory, exist_ok=True)
+    # (month, bucket) -> buffered orders, their row count and the number
+    # of files written so far
+    buffers = dict()
+    buffered_rows = dict()
+    parts = dict()
+    shards = list()
+
+    def flush(key):
+        month, bucket = key
+        orders = concat_orders(buffers.pop(key))
+        del buffered_rows[key]
+        shards.append(write_partition(
+            orders, directory, month, bucket, f"{parts.get(key, 0):05d}",
+            partition_format=partition_format))
+        parts[key] = parts.get(key, 0) + 1
+
+    for chunk, _ in iter_orders(file_name, chunk_size=chunk_size):
+        for month, bucket, orders in partition_groups(chunk,
+                                                      customer_buckets):
+            key = (month, bucket)
+            buffers.setdefault(key, list()).append(orders)
+            buffered_rows[key] = buffered_rows.get(key, 0) + len(orders)
+            if buffered_rows[key] >= chunk_size:
+                flush(key)
+    for key in sorted(buffers):
+        flush(key)
+    shards.sort(key=lambda shard: shard["file"])
+    rows = sum(shard["rows"] for shard in shards)
+    write_manifest(directory, shards=shards, orders=rows,
+                   partition_by=["month", "customer_id"],
+                   customer_buckets=customer_buckets)
+    logging.info(f"{rows} orders saved to {len(shards)} partitions in "
+                 f"{directory}")
+    return rows
+
+
+def is_partitioned(file_name: str) -> bool:
+    return (os.path.isdir(file_name)
+            and "partition_by" in read_manifest(file_name))
+
+
+def _aggregate_shard(task: dict) -> pd.DataFrame:
+    parts = [aggregate_orders(chunk).reset_index()
+             for chunk, _ in iter_orders(task["file"],
+                                         chunk_size=task["chunk_size"],
+                                         memory_map=task["memory_map"],
+                                         filters=task["filters"])
+             if not chunk.empty]
+    if not parts:
+        return None
+    return merge_aggregates(parts, GROUP_KEYS).reset_index()
+
+
+def aggregate_shards(directory: str, filters: dict = None,
+                     processes: int = None,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     memory_map: bool = False, progress=None):
+    """aggregate_orders of a dataset directory, or None when no orders
+    match filters. the shards that can match are aggregated by a process
+    pool and the results merged, progress is called with the fraction of
+    the shards done"""
+    shards = select_shards(read_manifest(directory)["shards"], filters)
+    tasks = [{"file": os.path.join(directory, shard["file"]),
+              "chunk_size": chunk_size,
+              "memory_map": memory_map,
+              "filters": filters} for shard in shards]
+
+    def collect(results) -> list:
+        parts = list()
+        for done, part in enumerate(results, start=1):
+            if part is not None:
+                parts.append(part)
+            if progress is not None:
+                progress(done / len(tasks))
+        return parts
+
+    processes = min(processes or os.cpu_count() or 1, len(tasks) or 1)
+    if processes == 1:
+        parts = collect(map(_aggregate_shard, tasks))
+    else:
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(processes=processes) as pool:
+            parts = collect(pool.imap_unordered(_aggregate_shard, tasks))
+    if not parts:
+        return None
+    return merge_aggregates(parts, GROUP_KEYS)
@@ -0,0 +1,144 @@
+"""how the order generator draws customers, shop items and counts.
+
+uniform draws every customer and every shop item equally often. zipf
+makes a few customers and titles take most of the orders, seasonal
+favours the items of the peak months and bursty adds short runs of
+orders for one hot item on top of zipf. popularity is given per title
+and split evenly between the shop items of the title, so the orders per
+title follow it however many items share a title.
+"""
+import numpy as np
+
+
+# relative demand per month, January first, peaking before the holidays
+SEASONAL_WEIGHTS = (0.8, 0.7, 0.9, 1.0, 1.0, 1.1,
+                    1.2, 1.1, 1.0, 1.1, 1.6, 2.2)
+
+
+def _cdf(weights):
+    if weights is None:
+        return None
+    cdf = np.cumsum(weights, dtype=np.float64)
+    return cdf / cdf[-1]
+
+
+def _choose(rng: np.random.Generator, size: int, count: int, cdf):
+    """size draws from range(count), uniform when cdf is None"""
+    if cdf is None:
+        return rng.integers(0, count, size=size)
+    return np.searchsorted(cdf, rng.random(size), side="right")
+
+
+def zipf_weights(count: int, exponent: float) -> np.ndarray:
+    """weight of the i-th most popular of count keys, the first is the
+    most popular"""
+    return 1.0 / np.arange(1, count + 1, dtype=np.float64) ** exponent
+
+
+def title_item_weights(title_weights: np.ndarray,
+                       shop_items) -> np.ndarray:
+    """weight of every shop item, the weight of its title split evenly
+    between the items of that title"""
+    codes = shop_items["title"].cat.codes.to_numpy()
+    items_per_title = np.bincount(codes, minlength=len(title_weights))
+    return title_weights[codes] / items_per_title[codes]
+
+
+class UniformProfile:
+    name = "uniform"
+
+    def __init__(self, customers: int = 10, titles: int = 20):
+        self.customers = customers
+        self.titles = titles
+
+    def customer_weights(self):
+        return None
+
+    def item_weights(self, shop_items):
+        return None
+
+    def draw_items(self, rng: np.random.Generator, size: int,
+                   items_count: int, cdf) -> np.ndarray:
+        return _choose(rng, size, items_count, cdf)
+
+    def sampler(self, shop_items):
+        """a function of (rng, size) drawing the customer ids, shop item
+        positions and counts of size orders"""
+        customer_cdf = _cdf(self.customer_weights())
+        item_cdf = _cdf(self.item_weights(shop_items))
+        items_count = len(shop_items)
+
+        def draw(rng: np.random.Generator, size: int):
+            customer_ids = _choose(rng, size, self.customers,
+                                   customer_cdf) + 1
+            item_indexes = self.draw_items(rng, size, items_count, item_cdf)
+            counts = rng.integers(1, 10, size=size, endpoint=True)
+            return customer_ids, item_indexes, counts
+
+        return draw
+
+
+class ZipfProfile(UniformProfile):
+    """customers and titles ranked by id and category order, the first
+    ones are the hot keys"""
+    name = "zipf"
+
+    def __init__(self, customers: int = 10, titles: int = 20,
+                 exponent: float = 1.1):
+        super().__init__(customers=customers, titles=titles)
+        self.exponent = exponent
+
+    def customer_weights(self):
+        return zipf_weights(self.customers, self.exponent)
+
+    def item_weights(self, shop_items):
+        titles_count = len(shop_items["title"].cat.categories)
+        return title_item_weights(zipf_weights(titles_count, self.exponent),
+                                  shop_items)
+
+
+class SeasonalProfile(UniformProfile):
+    """items are picked in proportion to the demand of their month"""
+    name = "seasonal"
+
+    def __init__(self, customers: int = 10, titles: int = 20,
+                 month_weights: tuple = SEASONAL_WEIGHTS):
+        super().__init__(customers=customers, titles=titles)
+        self.month_weights = np.asarray(month_weights, dtype=np.float64)
+
+    def item_weights(self, shop_items):
+        return self.month_weights[shop_items["month"].to_numpy() - 1]
+
+
+class BurstyProfile(ZipfProfile):
+    """zipf, and in every run of burst_size orders a burst_share of them
+    goes to a single hot item drawn for that run"""
+    name = "bursty"
+
+    def __init__(self, customers: int = 10, titles: int = 20,
+                 exponent: float = 1.1, burst_size: int = 1000,
+                 burst_share: float = 0.5):
+        super().__init__(customers=customers, titles=titles,
+                         exponent=exponent)
+        self.burst_size = burst_size
+        self.burst_share = burst_share
+
+    def draw_items(self, rng: np.random.Generator, size: int,
+                   items_count: int, cdf) -> np.ndarray:
+        item_indexes = _choose(rng, size, items_count, cdf)
+        bursts = -(-size // self.burst_size)
+        hot_items = _choose(rng, bursts, items_count, cdf)
+        in_burst = rng.random(size) < self.burst_share
+        burst_of = np.arange(size) // self.burst_size
+        item_indexes[in_burst] = hot_items[burst_of[in_burst]]
+        return item_indexes
+
+
+PROFILES = {profile.name: profile for profile in (
+    UniformProfile, ZipfProfile, SeasonalProfile, BurstyProfile)}
+
+
+def make_profile(name: str = "uniform", **options):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown workload profile: {name}")
+    return PROFILES[name](**options)
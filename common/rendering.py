@@ -0,0 +1,167 @@
+"""render the charts to image files, or image bytes, without a display.
+
+the charts are drawn with the Agg backend on one Figure that is kept and
+cleared between charts, pyplot and its global figure manager are never
+used.
+"""
+import io
+import logging
+import os
+import re
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from common.aggregation import mean_price
+from common.options import IMAGE_FORMATS
+
+
+class HeadlessRenderer:
+    def __init__(self, output_dir: str = None, image_format: str = "png",
+                 figsize=(6.4, 4.8), dpi: int = 100):
+        """without an output_dir the charts can only be taken as bytes"""
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self._axes = list()
+
+    def axes(self, count: int = 1) -> list:
+        """count empty axes side by side, reused when the layout repeats"""
+        if len(self._axes) != count:
+            self.figure.clear()
+            self._axes = list(self.figure.subplots(1, count,
+                                                   squeeze=False)[0])
+        else:
+            for axis in self._axes:
+                axis.clear()
+        return self._axes
+
+    def save(self, name: str) -> str:
+        file_name = re.sub(r"[^\w.-]", "_", name)
+        path = os.path.join(self.output_dir,
+                            f"{file_name}.{self.image_format}")
+        self.figure.tight_layout()
+        self.figure.savefig(path, format=self.image_format)
+        return path
+
+    def image_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        self.figure.tight_layout()
+        self.figure.savefig(buffer, format=self.image_format)
+        return buffer.getvalue()
+
+
+def draw_bar(axis, x_data, y_data, x_label: str, y_label: str, title: str,
+             color: str):
+    positions = range(len(x_data))
+    axis.bar(positions, y_data, color=color, label=y_label)
+    axis.set_xticks(positions, [str(x) for x in x_data], rotation=90)
+    axis.set_title(title)
+    axis.set_xlabel(x_label)
+    axis.set_ylabel(y_label)
+    axis.legend()
+
+
+def draw_line(axis, x_data, y_data, x_label: str, y_label: str, title: str,
+              color: str):
+    axis.plot(x_data, y_data)
+    axis.set_xlabel(x_label)
+    axis.set_ylabel(y_label, color=color)
+    axis.set_title(title)
+
+
+def customer_charts(cube, customer_id: int) -> dict:
+    """name -> (draw function, its arguments after the axis) of the three
+    charts of CustomerApp, KeyError for an unknown customer"""
+    monthly_stats = cube.monthly(customer_id=customer_id)
+    if monthly_stats.empty:
+        raise KeyError(customer_id)
+    item_stats = cube.per_title(customer_id=customer_id)
+    return {
+        "purchases": (draw_bar, monthly_stats.index, monthly_stats["count"],
+                      'Month', 'Number of Purchases',
+                      'Number of Purchases Per Month', 'red'),
+        "amount": (draw_bar, monthly_stats.index,
+                   monthly_stats["total_price"], 'Month', 'Amount Spent',
+                   'Total Amount Spent Per Month', 'green'),
+        "products": (draw_bar, item_stats.index, item_stats["total_price"],
+                     'Item', 'Number of Purchases',
+                     'Number of Each Product Purchased', 'orange'),
+    }
+
+
+def product_charts(cube, title: str) -> dict:
+    """name -> (draw function, its arguments after the axis) of the two
+    charts of SalesApp, KeyError for an unknown product"""
+    monthly_stats = cube.monthly(title=title)
+    if monthly_stats.empty:
+        raise KeyError(title)
+    return {
+        "sales": (draw_line, monthly_stats.index, monthly_stats["count"],
+                  "Month", "Sales", f"Sales per month for {title}",
+                  'tab:red'),
+        "price": (draw_line, monthly_stats.index, mean_price(monthly_stats),
+                  "Month", "Price", f"Price per month for {title}",
+                  'tab:blue'),
+    }
+
+
+def draw_chart(renderer: HeadlessRenderer, chart: tuple):
+    draw, *arguments = chart
+    axis, = renderer.axes(1)
+    draw(axis, *arguments)
+
+
+def draw_report(renderer: HeadlessRenderer, items, item_stats):
+    """the two charts of the best sellers report, side by side"""
+    sales_axis, purchase_axis = renderer.axes(2)
+    for item in items:
+        monthly_stats = item_stats.loc[item]
+        sales_axis.plot(monthly_stats.index, monthly_stats["count"],
+                        label=item)
+        purchase_axis.plot(monthly_stats.index,
+                           monthly_stats["total_price"], label=item)
+    sales_axis.set_xlabel("Month")
+    sales_axis.set_ylabel("total_sale_count")
+    sales_axis.set_title("Total sale count per month for items")
+    purchase_axis.set_xlabel("Month")
+    purchase_axis.set_ylabel("Purchase")
+    purchase_axis.set_title("Purchase per month for items")
+    if len(items):
+        sales_axis.legend()
+        purchase_axis.legend()
+
+
+def render_customer(renderer: HeadlessRenderer, cube,
+                    customer_id: int) -> list:
+    """the three charts of CustomerApp, KeyError for an unknown customer"""
+    paths = list()
+    for name, chart in customer_charts(cube, customer_id).items():
+        draw_chart(renderer, chart)
+        paths.append(renderer.save(f"customer-{customer_id}-{name}"))
+    return paths
+
+
+def render_product(renderer: HeadlessRenderer, cube, title: str) -> list:
+    """the two charts of SalesApp, KeyError for an unknown product"""
+    paths = list()
+    for name, chart in product_charts(cube, title).items():
+        draw_chart(renderer, chart)
+        paths.append(renderer.save(f"product-{title}-{name}"))
+    return paths
+
+
+def render_all(render, renderer: HeadlessRenderer, cube, keys) -> list:
+    """render(renderer, cube, key) for every key, unknown keys are logged
+    and skipped"""
+    paths = list()
+    for key in keys:
+        try:
+            paths.extend(render(renderer, cube, key))
+        except KeyError:
+            logging.error(f"{key} not found.")
+    return paths
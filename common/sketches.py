@@ -0,0 +1,131 @@
+"""bounded memory summaries of an unbounded stream of orders.
+
+SpaceSaving keeps the heaviest keys of a weighted stream in a fixed
+number of slots (Metwally, Agrawal and El Abbadi, "Efficient computation
+of frequent and top-k elements in data streams"). HyperLogLog estimates
+the number of distinct values from 2 ** precision one byte registers
+(Flajolet et al.), here one row of registers per SpaceSaving slot. both
+are updated a whole batch at a time with numpy.
+"""
+import heapq
+import numpy as np
+
+
+SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+SPLITMIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9),
+                        np.uint64(0x94D049BB133111EB))
+
+
+def hash64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 of integer values, well mixed 64 bit hashes"""
+    z = np.asarray(values).astype(np.uint64) + SPLITMIX_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * SPLITMIX_MULTIPLIERS[0]
+    z = (z ^ (z >> np.uint64(27))) * SPLITMIX_MULTIPLIERS[1]
+    return z ^ (z >> np.uint64(31))
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """int.bit_length of every uint64 value, without going through float
+    which rounds values above 2 ** 53"""
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class SpaceSaving:
+    """the capacity heaviest keys of a stream of (key, weight) updates.
+
+    a tracked key's count overestimates its true weight by at most its
+    error, and every key heavier than total / capacity is tracked. keys
+    are non negative integers.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.keys = np.full(capacity, -1, dtype=np.int64)
+        self.counts = np.zeros(capacity, dtype=np.float64)
+        self.errors = np.zeros(capacity, dtype=np.float64)
+        self._slots = dict()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, keys: np.ndarray, weights: np.ndarray) -> tuple:
+        """add the weights of distinct keys. returns the slot of every key
+        and the slots that were handed to a new key, whose data attached
+        by the caller is stale. keys evicted by a later key of the same
+        call get slot -1"""
+        slots = np.array([self._slots.get(key, -1) for key in keys.tolist()],
+                         dtype=np.int64)
+        tracked = slots >= 0
+        self.counts[slots[tracked]] += weights[tracked]
+        new = np.flatnonzero(~tracked)
+        if not new.size:
+            return slots, new
+        # the heaviest new keys first, so they are not evicted by lighter
+        # keys of the same batch
+        new = new[np.argsort(-weights[new], kind="stable")]
+        free = self.capacity - len(self._slots)
+        for position in new[:free]:
+            slot = len(self._slots)
+            self._claim(slot, int(keys[position]), float(weights[position]),
+                        0.0)
+            slots[position] = slot
+        if new.size > free:
+            heap = list(zip(self.counts.tolist(), range(self.capacity)))
+            heapq.heapify(heap)
+            for position in new[free:]:
+                minimum, slot = heapq.heappop(heap)
+                del self._slots[int(self.keys[slot])]
+                self._claim(slot, int(keys[position]),
+                            minimum + float(weights[position]), minimum)
+                heapq.heappush(heap, (float(self.counts[slot]), slot))
+                slots[position] = slot
+            slots[self.keys[slots] != keys] = -1
+        claimed = slots[new]
+        return slots, np.unique(claimed[claimed >= 0])
+
+    def _claim(self, slot: int, key: int, count: float, error: float):
+        self._slots[key] = slot
+        self.keys[slot] = key
+        self.counts[slot] = count
+        self.errors[slot] = error
+
+    def tracked(self) -> np.ndarray:
+        """the slots holding a key"""
+        return np.flatnonzero(self.keys >= 0)
+
+
+class HyperLogLog:
+    """distinct value counts of rows of registers, one row per counter"""
+
+    def __init__(self, rows: int, precision: int = 11):
+        self.precision = precision
+        self.registers = np.zeros((rows, 1 << precision), dtype=np.uint8)
+
+    def reset(self, rows: np.ndarray):
+        self.registers[rows] = 0
+
+    def add(self, rows: np.ndarray, values: np.ndarray):
+        """add values[i] to the counter of rows[i]"""
+        hashes = hash64(values)
+        buckets = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        ranks = (64 - self.precision) - bit_length(rest) + 1
+        np.maximum.at(self.registers, (rows, buckets),
+                      ranks.astype(np.uint8))
+
+    def estimate(self, rows: np.ndarray) -> np.ndarray:
+        registers = self.registers[rows].astype(np.float64)
+        m = registers.shape[1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-registers), axis=1)
+        zeros = np.count_nonzero(registers == 0, axis=1)
+        # linear counting is more accurate for small counts
+        small = (raw <= 2.5 * m) & (zeros > 0)
+        linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where(small, linear, raw)
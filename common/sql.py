@@ -0,0 +1,287 @@
+"""the OrderCube queries as parameterized SQL over a SQLite copy of the
+orders file.
+
+the orders are copied once into a database file next to the orders file,
+with indexes on customer_id, title and month, and the copy is rebuilt
+when the orders file changes. titles are listed in the order OrderCube
+gives them, the category order of the orders file, which is kept in a
+table of its own. queries share a small pool of read only connections,
+so they can run from worker threads, and a forked process opens
+connections of its own.
+"""
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from common.aggregation import unit_prices
+from common.options import RANKINGS
+from common.storage import DEFAULT_CHUNK_SIZE, file_fingerprint, iter_orders
+
+
+DATABASE_FILE_SUFFIX = ".sqlite"
+# databases of another version are rebuilt, bump it when SCHEMA changes
+DATABASE_VERSION = 2
+POOL_SIZE = 4
+SCHEMA = (
+    "CREATE TABLE orders (customer_id INTEGER NOT NULL, "
+    "title TEXT NOT NULL, month INTEGER NOT NULL, count INTEGER NOT NULL, "
+    "total_price NUMERIC NOT NULL, price REAL NOT NULL)",
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "CREATE TABLE titles (title TEXT PRIMARY KEY, "
+    "position INTEGER NOT NULL)",
+)
+# covering indexes, a lookup reads the index only and never the table
+INDEXES = (
+    "CREATE INDEX orders_customer_id ON orders "
+    "(customer_id, month, title, count, total_price, price)",
+    "CREATE INDEX orders_title ON orders "
+    "(title, month, count, total_price, price)",
+    "CREATE INDEX orders_month ON orders "
+    "(month, title, count, total_price, price)",
+)
+# the aggregation.MEASURES of a group of orders
+MEASURES_SQL = ("COUNT(*) AS orders, SUM(count) AS count, "
+                "SUM(total_price) AS total_price, SUM(price) AS price_sum")
+
+
+def _param(value):
+    """sqlite3 only binds python scalars"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _where(customer_id=None, title=None, month=None) -> tuple:
+    clauses = list()
+    params = list()
+    for column, value in (("customer_id", customer_id), ("title", title),
+                          ("month", month)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(_param(value))
+    if not clauses:
+        return "", params
+    return "WHERE " + " AND ".join(clauses), params
+
+
+class TitleOrder:
+    """the title order OrderCube ends up with for a file read in chunks:
+    the category order when every chunk has the same categories, which
+    concat keeps, and sorted titles otherwise"""
+
+    def __init__(self):
+        self.titles = None
+        self.same = True
+
+    def add(self, titles: pd.Series):
+        if isinstance(titles.dtype, pd.CategoricalDtype):
+            categories = [str(title) for title in titles.cat.categories]
+        else:
+            self.same = False
+            categories = [str(title) for title in titles.unique()]
+        if self.titles is None:
+            self.titles = categories
+        elif categories != self.titles:
+            self.same = False
+            self.titles = sorted(set(self.titles) | set(categories))
+
+    def positions(self):
+        titles = self.titles or list()
+        if not self.same:
+            titles = sorted(titles)
+        return enumerate(titles)
+
+
+class ConnectionPool:
+    """read only connections to one database file, shared by threads"""
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _check_process(self):
+        # connections must not cross a fork, a child starts a pool of its
+        # own. the pid is set last, other threads wait on the lock until
+        # the pool is ready
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._idle = queue.LifoQueue()
+                self._slots = threading.BoundedSemaphore(self.size)
+                self._pid = pid
+
+    @contextlib.contextmanager
+    def connection(self):
+        self._check_process()
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = sqlite3.connect(f"file:{self.path}?mode=ro",
+                                             uri=True,
+                                             check_same_thread=False)
+            try:
+                yield connection
+            finally:
+                self._idle.put(connection)
+
+    def close(self):
+        self._check_process()
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class SqlOrderStore:
+    """OrderCube's query methods answered by SQL over the order rows"""
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool = ConnectionPool(path, size=pool_size)
+        # the database is never appended to, kept for the callers caching
+        # results per cube version
+        self.version = 0
+
+    @classmethod
+    def cached(cls, file_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               progress=None):
+        """the database next to file_name, built first if it is missing
+        or was built from another version of the file"""
+        path = file_name + DATABASE_FILE_SUFFIX
+        fingerprint = file_fingerprint(file_name)
+        if cls.stored_fingerprint(path) == fingerprint:
+            logging.info(f"Order database opened from {path}")
+        else:
+            cls.build(file_name, path, fingerprint, chunk_size=chunk_size,
+                      progress=progress)
+        return cls(path)
+
+    @staticmethod
+    def stored_fingerprint(path: str):
+        if not os.path.exists(path):
+            return None
+        try:
+            with contextlib.closing(sqlite3.connect(
+                    f"file:{path}?mode=ro", uri=True)) as connection:
+                meta = dict(connection.execute(
+                    "SELECT key, value FROM meta").fetchall())
+        except sqlite3.Error:
+            return None
+        if (meta.get("version") != str(DATABASE_VERSION)
+                or "fingerprint" not in meta):
+            return None
+        return tuple(int(value) for value in meta["fingerprint"].split(","))
+
+    @staticmethod
+    def build(file_name: str, path: str, fingerprint: tuple,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, progress=None):
+        """copy the orders into a new database, the indexes are created
+        once all the rows are in"""
+        temp_path = path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        rows = 0
+        title_order = TitleOrder()
+        with contextlib.closing(sqlite3.connect(temp_path)) as connection:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            for chunk, fraction in iter_orders(file_name,
+                                               chunk_size=chunk_size):
+                connection.executemany(
+                    "INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                    zip(chunk["customer_id"].tolist(),
+                        chunk["title"].astype(str).tolist(),
+                        chunk["month"].tolist(),
+                        chunk["count"].tolist(),
+                        chunk["total_price"].tolist(),
+                        unit_prices(chunk).tolist()))
+                title_order.add(chunk["title"])
+                rows += len(chunk)
+                if progress is not None:
+                    progress(fraction)
+            for statement in INDEXES:
+                connection.execute(statement)
+            connection.executemany(
+                "INSERT INTO titles VALUES (?, ?)",
+                ((title, position)
+                 for position, title in title_order.positions()))
+            connection.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                (("fingerprint", ",".join(str(value)
+                                          for value in fingerprint)),
+                 ("version", str(DATABASE_VERSION))))
+            connection.commit()
+        os.replace(temp_path, path)
+        logging.info(f"{rows} orders copied to {path}")
+
+    def query(self, sql: str, params=()) -> pd.DataFrame:
+        with self.pool.connection() as connection:
+            return pd.read_sql_query(sql, connection, params=list(params))
+
+    def _scalar(self, sql: str, params=()):
+        with self.pool.connection() as connection:
+            return connection.execute(sql, list(params)).fetchone()[0]
+
+    @property
+    def orders_count(self) -> int:
+        return int(self._scalar("SELECT COUNT(*) FROM orders"))
+
+    @property
+    def empty(self) -> bool:
+        return self._scalar("SELECT EXISTS (SELECT 1 FROM orders)") == 0
+
+    def monthly(self, customer_id=None, title=None) -> pd.DataFrame:
+        """the MEASURES per month, optionally for one customer or title"""
+        where, params = _where(customer_id=customer_id, title=title)
+        return self.query(f"SELECT month, {MEASURES_SQL} FROM orders "
+                          f"{where} GROUP BY month ORDER BY month",
+                          params).set_index("month")
+
+    def per_title(self, customer_id=None, month=None) -> pd.DataFrame:
+        """the MEASURES per title, optionally for one customer or month"""
+        where, params = _where(customer_id=customer_id, month=month)
+        return self.query(f"SELECT title, {MEASURES_SQL} FROM orders "
+                          f"JOIN titles USING (title) {where} "
+                          "GROUP BY title ORDER BY position",
+                          params).set_index("title")
+
+    def top_titles(self, k: int = 5, by: str = "units", month=None,
+                   customer_id=None) -> pd.Series:
+        """the k best selling titles ranked by units sold or revenue"""
+        column = RANKINGS[by]
+        where, params = _where(customer_id=customer_id, month=month)
+        # at least one row, so that k = 0 gives the dtype of the sums
+        stats = self.query(f"SELECT title, SUM({column}) AS {column} "
+                           f"FROM orders JOIN titles USING (title) {where} "
+                           f"GROUP BY title "
+                           f"ORDER BY {column} DESC, position LIMIT ?",
+                           params + [max(k, 1)])
+        return stats.set_index("title")[column].iloc[:max(k, 0)]
+
+    def monthly_per_title(self, titles: list) -> pd.DataFrame:
+        """the MEASURES per (title, month) of the given titles"""
+        titles = [str(title) for title in titles]
+        placeholders = ", ".join("?" * len(titles))
+        return self.query(f"SELECT title, month, {MEASURES_SQL} "
+                          f"FROM orders JOIN titles USING (title) "
+                          f"WHERE title IN ({placeholders}) "
+                          f"GROUP BY title, month ORDER BY position, month",
+                          titles).set_index(["title", "month"])
+
+    def customers(self) -> pd.Index:
+        return pd.Index(self.query(
+            "SELECT DISTINCT customer_id FROM orders ORDER BY customer_id"
+        )["customer_id"])
+
+    def titles(self) -> pd.Index:
+        return pd.Index(self.query(
+            "SELECT title FROM titles WHERE EXISTS (SELECT 1 FROM orders "
+            "WHERE orders.title = titles.title) ORDER BY position")["title"])
@@ -0,0 +1,427 @@
+"""read and write order tables, the file format is picked from the
+file extension. a directory is a sharded dataset, read as one table
+through its manifest file.
+
+readers take filters, a dict of column -> value such as {"month": 3},
+or column -> list of values such as {"title": ["Item1", "Item7"]}, and
+only return the matching orders. shards whose manifest entry has the
+min and max of a filtered column are skipped without being opened when
+the value is out of their range.
+"""
+import io
+import itertools
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from common.options import DEFAULT_CHUNK_SIZE
+
+
+ORDER_COLUMNS = ("customer_id", "title", "month", "count", "total_price")
+ORDER_DTYPES = {
+    "customer_id": "int32",
+    "title": "category",
+    "month": "int8",
+    "count": "int16",
+}
+JSON_EXTENSIONS = (".json",)
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+FEATHER_EXTENSIONS = (".feather", ".arrow")
+NPZ_EXTENSIONS = (".npz",)
+CATEGORY_COLUMNS = ("title", "description")
+INTEGER_COLUMNS = ("customer_id", "month", "count")
+FLOAT_COLUMNS = ("total_price", "price")
+INDEX_COLUMN = "__index__"
+MANIFEST_FILE = "manifest.json"
+
+
+def file_format(file_name: str) -> str:
+    if os.path.isdir(file_name):
+        return "manifest"
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in JSON_EXTENSIONS:
+        return "json"
+    if extension in JSON_LINES_EXTENSIONS:
+        return "json_lines"
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in FEATHER_EXTENSIONS:
+        return "feather"
+    if extension in NPZ_EXTENSIONS:
+        return "npz"
+    raise ValueError(f"Unsupported order file format: {file_name}")
+
+
+def file_fingerprint(file_name: str) -> tuple:
+    """(size, modification time), changes whenever the file is rewritten.
+    the manifest stands for a sharded dataset, it is written last"""
+    if os.path.isdir(file_name):
+        file_name = os.path.join(file_name, MANIFEST_FILE)
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def apply_schema(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """cast the order columns to their compact types"""
+    dtypes = {column: dtype for column, dtype in ORDER_DTYPES.items()
+              if column in data_frame.columns}
+    return data_frame.astype(dtypes)
+
+
+def downcast_float(values: pd.Series) -> pd.Series:
+    """the smallest type holding every value exactly: an integer type if
+    they are all whole numbers, else float32 if that is exact, else the
+    values unchanged"""
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return pd.to_numeric(values, downcast="integer")
+    if not pd.api.types.is_float_dtype(values.dtype) or values.isna().any():
+        return values
+    data = values.to_numpy()
+    if np.array_equal(data, np.round(data)):
+        return pd.to_numeric(values.astype(np.int64), downcast="integer")
+    single = data.astype(np.float32)
+    if np.array_equal(single, data):
+        return pd.Series(single, index=values.index, name=values.name)
+    return values
+
+
+def _compact(data_frame: pd.DataFrame) -> pd.DataFrame:
+    columns = dict()
+    for column in data_frame.columns:
+        values = data_frame[column]
+        if column in CATEGORY_COLUMNS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype("category")
+        elif column in INTEGER_COLUMNS:
+            if pd.api.types.is_integer_dtype(values.dtype):
+                values = pd.to_numeric(values, downcast="integer")
+        elif column in FLOAT_COLUMNS:
+            values = downcast_float(values)
+        columns[column] = values
+    index = data_frame.index
+    if (not isinstance(index, pd.RangeIndex) and len(index)
+            and pd.api.types.is_integer_dtype(index.dtype)):
+        range_index = pd.RangeIndex(index[0], index[0] + len(index))
+        if index.equals(range_index):
+            index = range_index
+    return pd.DataFrame(columns, index=index)
+
+
+def memory_usage(data_frame: pd.DataFrame) -> int:
+    return int(data_frame.memory_usage(deep=True).sum())
+
+
+def compact_orders(data_frame: pd.DataFrame,
+                   report: bool = True) -> pd.DataFrame:
+    """dictionary encode the text columns and downcast the numeric ones
+    to the smallest types that hold their values exactly"""
+    before = memory_usage(data_frame) if report else 0
+    data_frame = _compact(data_frame)
+    if report:
+        after = memory_usage(data_frame)
+        logging.info(f"Orders memory {before / 2 ** 20:.1f} MiB -> "
+                     f"{after / 2 ** 20:.1f} MiB")
+    return data_frame
+
+
+def write_manifest(directory: str, shards: list, **metadata):
+    """list the shard files of a dataset directory. shards are dicts with
+    the "file" name relative to the directory, its "rows" and the
+    "index_start" of its rows, which json lines files do not keep. they
+    may have the "min" and "max" of some columns, as dicts of column ->
+    value, for select_shards. call it once every shard is written"""
+    manifest = dict(metadata, shards=shards)
+    path = os.path.join(directory, MANIFEST_FILE)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as outfile:
+        json.dump(manifest, outfile, indent=4)
+    os.replace(temp_path, path)
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        return json.load(file)
+
+
+def _filter_values(value) -> list:
+    """the values a filter matches, one value or a list of them"""
+    if isinstance(value, (list, tuple, set, pd.Index, np.ndarray)):
+        return list(value)
+    return [value]
+
+
+def select_shards(shards: list, filters: dict = None) -> list:
+    """the shards that can hold orders matching filters, a shard without
+    min and max for a column is always kept"""
+    if not filters:
+        return list(shards)
+    selected = list()
+    for shard in shards:
+        low = shard.get("min", dict())
+        high = shard.get("max", dict())
+        if all(value is None
+               or not (column in low and column in high)
+               or any(low[column] <= one <= high[column]
+                      for one in _filter_values(value))
+               for column, value in filters.items()):
+            selected.append(shard)
+    return selected
+
+
+def filter_orders(data_frame: pd.DataFrame,
+                  filters: dict = None) -> pd.DataFrame:
+    """the orders whose columns equal the filters values, or one of them
+    for a list, a None value does not filter"""
+    mask = None
+    for column, value in (filters or dict()).items():
+        if value is None:
+            continue
+        values = _filter_values(value)
+        if len(values) == 1:
+            column_mask = data_frame[column].to_numpy() == values[0]
+        else:
+            column_mask = data_frame[column].isin(values).to_numpy()
+        mask = column_mask if mask is None else mask & column_mask
+    if mask is None or mask.all():
+        return data_frame
+    return data_frame[mask]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("pyarrow is required for parquet and feather "
+                          "files, install it with `pip install pyarrow`"
+                          ) from e
+
+
+def save_orders(data_frame: pd.DataFrame, file_name: str,
+                report: bool = True):
+    """write the orders, the format is picked from the file extension.
+    with report the number of orders written is logged"""
+    fmt = file_format(file_name)
+    if fmt == "json":
+        data_frame.to_json(file_name)
+        return
+    if fmt == "json_lines":
+        data_frame.to_json(file_name, orient="records", lines=True)
+        return
+    data_frame = apply_schema(data_frame)
+    if fmt == "parquet":
+        _require_pyarrow()
+        data_frame.to_parquet(file_name)
+    elif fmt == "feather":
+        _require_pyarrow()
+        from pyarrow import feather
+        frame = data_frame.reset_index(names=INDEX_COLUMN)
+        # uncompressed so the file can be memory mapped on load
+        feather.write_feather(frame, file_name, compression="uncompressed")
+    else:
+        arrays = {INDEX_COLUMN: data_frame.index.to_numpy()}
+        for column in data_frame.columns:
+            values = data_frame[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                arrays[f"{column}.codes"] = values.cat.codes.to_numpy()
+                arrays[f"{column}.categories"] = (
+                    values.cat.categories.to_numpy(dtype=str))
+            else:
+                arrays[column] = values.to_numpy()
+        np.savez(file_name, **arrays)
+    if report:
+        logging.info(f"{len(data_frame)} orders saved to {file_name}")
+
+
+def _load_npz(file_name: str) -> pd.DataFrame:
+    columns = dict()
+    with np.load(file_name, allow_pickle=False) as arrays:
+        index = arrays[INDEX_COLUMN]
+        for key in arrays.files:
+            if key == INDEX_COLUMN or key.endswith(".categories"):
+                continue
+            if key.endswith(".codes"):
+                column = key[:-len(".codes")]
+                categories = arrays[f"{column}.categories"]
+                columns[column] = pd.Categorical.from_codes(
+                    arrays[key], categories=categories)
+            else:
+                columns[key] = arrays[key]
+    return pd.DataFrame(columns, index=index)
+
+
+def _iter_json_lines(file_name: str, chunk_size: int):
+    size = os.path.getsize(file_name)
+    rows_read = 0
+    with open(file_name, "rb") as file:
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                break
+            chunk = pd.read_json(io.BytesIO(b"".join(lines)), lines=True)
+            chunk.index += rows_read
+            rows_read += len(chunk)
+            yield chunk, file.tell() / size
+
+
+def _iter_parquet(file_name: str, chunk_size: int, memory_map: bool):
+    from pyarrow import parquet
+    parquet_file = parquet.ParquetFile(file_name, memory_map=memory_map)
+    rows = parquet_file.metadata.num_rows
+    # a RangeIndex is only kept in the pandas metadata, not as a column
+    metadata = parquet_file.schema_arrow.pandas_metadata or dict()
+    range_index = next((index for index in metadata.get("index_columns", ())
+                        if isinstance(index, dict)
+                        and index.get("kind") == "range"), None)
+    rows_read = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        chunk = batch.to_pandas()
+        if range_index is not None:
+            start = range_index["start"] + rows_read * range_index["step"]
+            chunk.index = pd.RangeIndex(
+                start, start + len(chunk) * range_index["step"],
+                range_index["step"])
+        rows_read += batch.num_rows
+        yield chunk, rows_read / rows
+
+
+def _iter_feather(file_name: str, chunk_size: int, memory_map: bool):
+    from pyarrow import feather
+    table = feather.read_table(file_name, memory_map=memory_map)
+    rows_read = 0
+    for batch in table.to_batches(max_chunksize=chunk_size):
+        rows_read += batch.num_rows
+        chunk = batch.to_pandas().set_index(INDEX_COLUMN).rename_axis(None)
+        yield chunk, rows_read / table.num_rows
+
+
+def _iter_shards(directory: str, chunk_size: int, memory_map: bool,
+                 filters: dict = None):
+    shards = select_shards(read_manifest(directory)["shards"], filters)
+    rows = sum(shard["rows"] for shard in shards) or 1
+    rows_before = 0
+    for shard in shards:
+        shard_file = os.path.join(directory, shard["file"])
+        for chunk, fraction in _iter_chunks(shard_file, chunk_size,
+                                            memory_map):
+            # json lines files do not keep the index
+            if file_format(shard_file) == "json_lines":
+                chunk.index += shard["index_start"]
+            yield chunk, (rows_before + fraction * shard["rows"]) / rows
+        rows_before += shard["rows"]
+
+
+def _iter_chunks(file_name: str, chunk_size: int, memory_map: bool,
+                 filters: dict = None):
+    """the chunks of the file, of only the shards that can match filters
+    for a dataset directory. the rows are not filtered here"""
+    fmt = file_format(file_name)
+    if fmt == "manifest":
+        yield from _iter_shards(file_name, chunk_size, memory_map, filters)
+    elif fmt == "json_lines":
+        yield from _iter_json_lines(file_name, chunk_size)
+    elif fmt == "parquet":
+        _require_pyarrow()
+        yield from _iter_parquet(file_name, chunk_size, memory_map)
+    elif fmt == "feather":
+        _require_pyarrow()
+        yield from _iter_feather(file_name, chunk_size, memory_map)
+    else:
+        yield _read_orders(file_name, memory_map), 1.0
+
+
+def iter_orders(file_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                memory_map: bool = False, compact: bool = True,
+                filters: dict = None):
+    """yield (chunk, fraction of the file read so far) pairs.
+
+    json lines, parquet and feather files are read chunk_size rows at a
+    time, json and npz files can only be read whole and come as a single
+    chunk. a sharded dataset is read shard after shard, skipping the
+    shards that cannot match filters. with compact every chunk goes
+    through compact_orders.
+    """
+    for chunk, fraction in _iter_chunks(file_name, chunk_size, memory_map,
+                                        filters):
+        chunk = filter_orders(chunk, filters)
+        if compact:
+            chunk = compact_orders(chunk, report=False)
+        yield chunk, fraction
+
+
+def concat_orders(chunks: list) -> pd.DataFrame:
+    """concatenate order chunks, keeping categorical columns categorical
+    even when the chunks have different categories"""
+    if len(chunks) == 1:
+        return chunks[0]
+    data_frame = pd.concat(chunks)
+    for column, dtype in chunks[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            data_frame[column] = data_frame[column].astype("category")
+    return data_frame
+
+
+def _read_orders(file_name: str, memory_map: bool) -> pd.DataFrame:
+    fmt = file_format(file_name)
+    if fmt == "json":
+        return pd.read_json(file_name)
+    if fmt == "manifest":
+        return concat_orders([chunk for chunk, _ in
+                              _iter_shards(file_name, DEFAULT_CHUNK_SIZE,
+                                           memory_map)])
+    if fmt == "json_lines":
+        return pd.read_json(file_name, lines=True)
+    if fmt == "parquet":
+        _require_pyarrow()
+        return pd.read_parquet(file_name, memory_map=memory_map)
+    if fmt == "feather":
+        _require_pyarrow()
+        from pyarrow import feather
+        table = feather.read_table(file_name, memory_map=memory_map)
+        return table.to_pandas().set_index(INDEX_COLUMN).rename_axis(None)
+    return _load_npz(file_name)
+
+
+def load_orders(file_name: str, memory_map: bool = False, progress=None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                compact: bool = True, filters: dict = None) -> pd.DataFrame:
+    """load an order table, memory_map only applies to parquet and
+    feather files. with filters only the matching orders are kept, and
+    only the shards that can hold them are read.
+
+    progress, if given, is called with the fraction of the file read so
+    far. formats that can be read in chunks report after every chunk,
+    the others only once the whole file is loaded. with compact the
+    table goes through compact_orders, and the memory it takes before
+    and after is logged. the shards of a sharded dataset are compacted one
+    by one.
+    """
+    if progress is None and file_format(file_name) != "manifest":
+        data_frame = filter_orders(_read_orders(file_name, memory_map),
+                                   filters)
+        if compact:
+            data_frame = compact_orders(data_frame)
+        return data_frame
+
+    chunks = list()
+    before = 0
+    for chunk, fraction in _iter_chunks(file_name, chunk_size, memory_map,
+                                        filters):
+        chunk = filter_orders(chunk, filters)
+        if compact:
+            before += memory_usage(chunk)
+            chunk = compact_orders(chunk, report=False)
+        chunks.append(chunk)
+        if progress is not None:
+            progress(fraction)
+    if not chunks:
+        # every shard was skipped by the filters
+        return pd.DataFrame(columns=list(ORDER_COLUMNS))
+    data_frame = concat_orders(chunks)
+    if compact:
+        after = memory_usage(data_frame)
+        logging.info(f"Orders memory {before / 2 ** 20:.1f} MiB -> "
+                     f"{after / 2 ** 20:.1f} MiB")
+    return data_frame
@@ -0,0 +1,262 @@
+"""orders published as a stream of binary batches, and the running report
+statistics of that stream.
+
+a stream is a pipe ("-", stdout of the generator to stdin of the report)
+or a TCP connection ("host:port", the report listens and the generator
+connects). every message is a kind byte and a payload length followed by
+the payload:
+
+    T  json list of the titles that follow the titles sent so far, the
+       orders refer to a title by its position in that list
+    O  order records, ORDER_RECORD packed back to back
+    E  end of the stream
+
+StreamingStats keeps exact per month totals, the heaviest titles in a
+SpaceSaving summary with the monthly measures of every tracked title, and
+a HyperLogLog of the customers of every tracked title, so its memory does
+not grow with the number of orders.
+"""
+import contextlib
+import json
+import socket
+import struct
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from common.aggregation import MEASURES, top_k
+from common.options import RANKINGS
+from common.sketches import HyperLogLog, SpaceSaving
+
+
+ORDER_RECORD = np.dtype([("customer_id", "<i4"), ("title", "<i4"),
+                         ("month", "i1"), ("count", "<i2"),
+                         ("total_price", "<f8")])
+HEADER = struct.Struct("<cQ")
+TITLES, ORDERS, END = b"T", b"O", b"E"
+# the generator keeps trying to reach a report that is not listening yet
+CONNECT_TIMEOUT = 10.0
+MONTHS = 12
+
+
+def parse_address(address: str) -> tuple:
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+@contextlib.contextmanager
+def open_stream(address: str, mode: str):
+    """binary file of the stream at address, mode "rb" for the report and
+    "wb" for the generator. "-" is stdin or stdout"""
+    if address == "-":
+        yield sys.stdin.buffer if mode == "rb" else sys.stdout.buffer
+        return
+    if mode == "rb":
+        with socket.create_server(parse_address(address)) as server:
+            connection, _ = server.accept()
+    else:
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                connection = socket.create_connection(parse_address(address))
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    with connection, connection.makefile(mode) as stream:
+        yield stream
+
+
+def write_message(stream, kind: bytes, payload=b""):
+    stream.write(HEADER.pack(kind, len(payload)))
+    stream.write(payload)
+
+
+def read_exactly(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("The order stream ended in the middle of a message")
+    return data
+
+
+def iter_messages(stream):
+    """(kind, payload) of every message until the end message or the end
+    of the stream, titles decoded to a list and orders to ORDER_RECORD"""
+    while True:
+        header = stream.read(HEADER.size)
+        if not header:
+            return
+        if len(header) < HEADER.size:
+            raise EOFError("The order stream ended in the middle of a "
+                           "message")
+        kind, size = HEADER.unpack(header)
+        if kind == END:
+            return
+        payload = read_exactly(stream, size)
+        if kind == TITLES:
+            yield kind, json.loads(payload)
+        elif kind == ORDERS:
+            yield kind, np.frombuffer(payload, dtype=ORDER_RECORD)
+        else:
+            raise ValueError(f"Unknown order stream message {kind!r}")
+
+
+class OrderPublisher:
+    """writes order frames to a stream, titles are sent once, the first
+    time they are seen"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._codes = dict()
+        self.orders = 0
+
+    def send(self, orders: pd.DataFrame):
+        titles = orders["title"].astype("category")
+        categories = titles.cat.categories.tolist()
+        new_titles = [title for title in categories
+                      if title not in self._codes]
+        if new_titles:
+            for title in new_titles:
+                self._codes[title] = len(self._codes)
+            write_message(self.stream, TITLES,
+                          json.dumps(new_titles).encode())
+        codes = np.array([self._codes[title] for title in categories],
+                         dtype=np.int32)
+        records = np.empty(len(orders), dtype=ORDER_RECORD)
+        records["title"] = codes[titles.cat.codes.to_numpy()]
+        for column in ("customer_id", "month", "count", "total_price"):
+            records[column] = orders[column].to_numpy()
+        write_message(self.stream, ORDERS, memoryview(records).cast("B"))
+        self.orders += len(records)
+
+    def close(self):
+        write_message(self.stream, END)
+        self.stream.flush()
+
+
+class StreamingStats:
+    """running report statistics of an order stream in bounded memory.
+
+    the per month totals are exact. the titles are ranked by a
+    SpaceSaving summary of the by measure that holds capacity titles,
+    the monthly measures of a title are counted from the batch it was
+    last admitted to the summary on, and its distinct customers are
+    estimated by a HyperLogLog. answers the report queries of OrderCube.
+    """
+
+    def __init__(self, by: str = "units", capacity: int = 256,
+                 precision: int = 11):
+        self.by = by
+        self.titles = list()
+        self.orders = 0
+        self.totals = np.zeros((MONTHS, len(MEASURES)))
+        self.summary = SpaceSaving(capacity)
+        self.slot_measures = np.zeros((capacity, MONTHS, len(MEASURES)))
+        self.customers = HyperLogLog(capacity, precision=precision)
+        # bumped by update so callers can drop results computed earlier
+        self.version = 0
+
+    def add_titles(self, titles: list):
+        self.titles.extend(titles)
+
+    @staticmethod
+    def _measures(records: np.ndarray) -> tuple:
+        counts = records["count"].astype(np.float64)
+        return (None, counts, records["total_price"],
+                records["total_price"] / counts)
+
+    def update(self, records: np.ndarray):
+        """fold a batch of ORDER_RECORD orders into the statistics"""
+        if not len(records):
+            return
+        measures = self._measures(records)
+        months = records["month"].astype(np.int64) - 1
+        for column, weights in enumerate(measures):
+            self.totals[:, column] += np.bincount(months, weights=weights,
+                                                  minlength=MONTHS)
+
+        codes = records["title"].astype(np.int64)
+        weights = measures[MEASURES.index(RANKINGS[self.by])]
+        title_weights = np.bincount(codes, weights=weights)
+        batch_titles = np.flatnonzero(np.bincount(codes))
+        slots, reset = self.summary.update(batch_titles,
+                                           title_weights[batch_titles])
+        self.slot_measures[reset] = 0
+        self.customers.reset(reset)
+
+        slot_of_code = np.full(len(title_weights), -1, dtype=np.int64)
+        slot_of_code[batch_titles] = slots
+        order_slots = slot_of_code[codes]
+        tracked = order_slots >= 0
+        cells = order_slots[tracked] * MONTHS + months[tracked]
+        size = self.summary.capacity * MONTHS
+        for column, weights in enumerate(measures):
+            if weights is not None:
+                weights = weights[tracked]
+            self.slot_measures[:, :, column] += np.bincount(
+                cells, weights=weights, minlength=size).reshape(-1, MONTHS)
+
+        # one HyperLogLog update per distinct (title, customer) pair
+        pairs = np.unique(order_slots[tracked] << 32
+                          | records["customer_id"][tracked].astype(np.int64))
+        self.customers.add(pairs >> 32, pairs & 0xFFFFFFFF)
+        self.orders += len(records)
+        self.version += 1
+
+    @property
+    def empty(self) -> bool:
+        return self.orders == 0
+
+    @property
+    def orders_count(self) -> int:
+        return self.orders
+
+    def _tracked(self) -> tuple:
+        slots = self.summary.tracked()
+        titles = pd.Index([self.titles[code]
+                           for code in self.summary.keys[slots]],
+                          name="title")
+        return slots, titles
+
+    def top_titles(self, k: int = 5, by: str = "units", month=None,
+                   customer_id=None) -> pd.Series:
+        """the k titles with the largest summary counts, an upper bound
+        of their by measure"""
+        if by != self.by:
+            raise ValueError(f"The stream is ranked by {self.by}, not {by}")
+        if month is not None or customer_id is not None:
+            raise ValueError("The stream is only ranked over all orders")
+        slots, titles = self._tracked()
+        return top_k(pd.Series(self.summary.counts[slots], index=titles,
+                               name=RANKINGS[by]), k)
+
+    def monthly_per_title(self, titles: list) -> pd.DataFrame:
+        """the MEASURES per (title, month) of the given tracked titles"""
+        slots, tracked = self._tracked()
+        slots = slots[tracked.isin(titles)]
+        measures = self.slot_measures[slots].reshape(-1, len(MEASURES))
+        index = pd.MultiIndex.from_product(
+            [tracked[tracked.isin(titles)], np.arange(1, MONTHS + 1)],
+            names=["title", "month"])
+        stats = pd.DataFrame(measures, index=index, columns=list(MEASURES))
+        stats[["orders", "count"]] = stats[["orders", "count"]].astype(
+            np.int64)
+        return stats[stats["orders"] > 0]
+
+    def distinct_customers(self, titles: list) -> pd.Series:
+        """estimated number of distinct customers of the given tracked
+        titles"""
+        slots, tracked = self._tracked()
+        mask = tracked.isin(titles)
+        return pd.Series(self.customers.estimate(slots[mask]),
+                         index=tracked[mask], name="customers")
+
+    def monthly(self) -> pd.DataFrame:
+        """the exact MEASURES per month"""
+        stats = pd.DataFrame(self.totals, columns=list(MEASURES),
+                             index=pd.RangeIndex(1, MONTHS + 1, name="month"))
+        stats[["orders", "count"]] = stats[["orders", "count"]].astype(
+            np.int64)
+        return stats[stats["orders"] > 0]
@@ -0,0 +1,117 @@
+"""matplotlib charts embedded in a Tk window and updated in place.
+
+every chart keeps one Figure and one set of artists for the lifetime of
+the window. a new lookup only changes the bar heights or the line data
+and the title. the artists are animated, so when the axes did not change
+the saved background is restored and only the artists are drawn and
+blitted. a full redraw only happens when the ticks or the y range change.
+"""
+import math
+import numpy as np
+from matplotlib.figure import Figure
+
+
+CHART_KINDS = ("bar", "line")
+
+
+def nice_ceiling(value: float) -> float:
+    """the smallest 1, 2 or 5 times a power of ten that reaches value, so
+    that close values share the y range and can be blitted"""
+    if not value > 0:
+        return 1.0
+    power = 10.0 ** math.floor(math.log10(value))
+    for step in (1, 2, 5, 10):
+        if step * power >= value:
+            return step * power
+    return 10 * power
+
+
+class EmbeddedChart:
+    def __init__(self, master, kind: str, x_label: str, y_label: str,
+                 title: str, color: str, figsize=(4.8, 3.6), dpi: int = 100,
+                 canvas_class=None):
+        if kind not in CHART_KINDS:
+            raise ValueError(f"Unknown chart kind: {kind}")
+        if canvas_class is None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            canvas_class = FigureCanvasTkAgg
+        self.kind = kind
+        self.color = color
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.axis = self.figure.add_subplot()
+        self.canvas = canvas_class(self.figure, master=master)
+        self.axis.set_xlabel(x_label)
+        self.axis.set_ylabel(y_label, color=color)
+        self.title = self.axis.set_title(title, animated=True)
+        self.bars = None
+        self.line = None
+        if kind == "line":
+            self.line, = self.axis.plot([], [], animated=True)
+        # ticks and y range of the last full draw, and the figure as drawn
+        # then without the animated artists
+        self._layout = None
+        self._background = None
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def widget(self):
+        return self.canvas.get_tk_widget()
+
+    def _artists(self) -> list:
+        artists = [self.title]
+        if self.line is not None:
+            artists.append(self.line)
+        if self.bars is not None:
+            artists.extend(self.bars)
+        return artists
+
+    def _draw_artists(self):
+        for artist in self._artists():
+            self.figure.draw_artist(artist)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_artists()
+
+    def _set_bars(self, heights: np.ndarray):
+        if self.bars is not None and len(self.bars) == len(heights):
+            for bar, height in zip(self.bars, heights):
+                bar.set_height(height)
+            return
+        if self.bars is not None:
+            self.bars.remove()
+        self.bars = self.axis.bar(range(len(heights)), heights,
+                                  color=self.color, animated=True)
+
+    def update(self, x_data, y_data, title: str = None):
+        """show y_data over x_data, neither is modified"""
+        x_data = list(x_data)
+        y_data = np.ravel(np.asarray(y_data, dtype=np.float64))
+        if title is not None:
+            self.title.set_text(title)
+        if self.kind == "bar":
+            self._set_bars(y_data)
+            x_layout = tuple(str(x) for x in x_data)
+        else:
+            self.line.set_data(x_data, y_data)
+            x_layout = (min(x_data), max(x_data)) if x_data else (0, 1)
+        finite = y_data[np.isfinite(y_data)]
+        layout = (x_layout, nice_ceiling(finite.max() if finite.size
+                                         else 0.0))
+
+        if layout == self._layout and self._background is not None:
+            self.canvas.restore_region(self._background)
+            self._draw_artists()
+            self.canvas.blit(self.figure.bbox)
+            return
+        self._layout = layout
+        if self.kind == "bar":
+            self.axis.set_xticks(range(len(x_data)), x_layout, rotation=90)
+            self.axis.set_xlim(-0.5, len(x_data) - 0.5)
+        else:
+            low, high = x_layout
+            self.axis.set_xlim(low - 0.5, high + 0.5)
+        self.axis.set_ylim(0, layout[1])
+        self.figure.tight_layout()
+        # the draw_event handler saves the background and draws the
+        # animated artists on top
+        self.canvas.draw()
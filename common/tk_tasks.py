@@ -0,0 +1,29 @@
+"""run slow work off the Tk main loop.
+
+Tk widgets may only be touched from the thread running mainloop, so the
+work runs on an executor and the main loop polls for the result with
+master.after and hands it to a callback on the Tk thread.
+"""
+
+
+# about one frame at 60 Hz
+POLL_INTERVAL_MS = 16
+
+
+def run_in_background(master, executor, function, callback, *args,
+                      on_poll=None):
+    """call function(*args) on the executor, then callback(future) from
+    the Tk main loop once it is done. on_poll, if given, is called from
+    the main loop on every poll until then, e.g. to show progress"""
+    future = executor.submit(function, *args)
+
+    def poll():
+        if on_poll is not None:
+            on_poll()
+        if future.done():
+            callback(future)
+        else:
+            master.after(POLL_INTERVAL_MS, poll)
+
+    master.after(POLL_INTERVAL_MS, poll)
+    return future
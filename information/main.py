@@ -1,20 +1,29 @@
 """this function provide a json file that contains sales data of a mall"""
 from abc import ABC, abstractmethod
-from icecream import ic
+import argparse
 import json
 import logging
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
 import random
+import sys
+import time
 
-
-logging.basicConfig(level=logging.INFO)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.instrumentation import instrument  # noqa: E402
+from common.options import (add_generate_arguments,  # noqa: E402
+                            check_generate_arguments)
+from common.partitions import partition_frame  # noqa: E402
+from common.profiles import UniformProfile, make_profile  # noqa: E402
+from common.storage import (file_format, save_orders,  # noqa: E402
+                            write_manifest)
 
 
-def log_decorator(func):
-    def wrapper(*args, **kwargs):
-        logging.info(f"{func.__name__} was called")
-        return func(*args, **kwargs)
+logging.basicConfig(level=logging.INFO)
 
-    return wrapper
+ORDER_COLUMNS = ("customer_id", "title", "month", "count", "total_price")
 
 
 class BaseModel(ABC):
@@ -25,12 +34,12 @@ class BaseModel(ABC):
         raise NotImplementedError('Please implement this method')
 
     @abstractmethod
-    @log_decorator
+    @instrument
     def to_json(self):
         pass
 
     @abstractmethod
-    @log_decorator
+    @instrument
     def to_dictionary(self):
         pass
 
@@ -55,7 +64,7 @@ class ShopItemInfo(BaseModel):
                 f'sold_count = {self.sold_count} ')
 
     @staticmethod
-    @log_decorator
+    @instrument
     def parse_item_info(data: dict):
         title = data.get('title')
         description = data.get('description')
@@ -64,7 +73,7 @@ class ShopItemInfo(BaseModel):
         quantity = data.get('quantity')
         return title, description, price, quantity, month
 
-    @log_decorator
+    @instrument
     def buy_item(self,
                  count: int,
                  ):
@@ -72,11 +81,11 @@ class ShopItemInfo(BaseModel):
             self.sold_count += count
             self.quantity -= count
 
-    @log_decorator
+    @instrument
     def to_json(self):
         pass
 
-    @log_decorator
+    @instrument
     def to_dictionary(self):
         pass
 
@@ -90,7 +99,7 @@ class StoreOrder(BaseModel):
          self.count, self.total_price) = order_info
 
     @staticmethod
-    @log_decorator
+    @instrument
     def parse_order_info(data: dict):
         customer_id = data.get('customer_id')
         title = data.get('title')
@@ -99,7 +108,7 @@ class StoreOrder(BaseModel):
         total_price = data.get('total_price')
         return customer_id, title, month, count, total_price
 
-    @log_decorator
+    @instrument
     def to_dictionary(self):
         return {
             'customer_id': self.customer_id,
@@ -109,16 +118,16 @@ class StoreOrder(BaseModel):
             'total_price': self.total_price
         }
 
-    @log_decorator
+    @instrument
     def to_json(self):
         return json.dumps(self.to_dictionary())
 
-    @log_decorator
+    @instrument
     def __str__(self):
         return str(self.to_dictionary())
 
 
-@log_decorator
+@instrument
 def generate_shop_items(items_count: int) -> list:
     prices = [i for i in range(10, 200, 10)]
     titles = [f"Item{i}" for i in range(20)]
@@ -136,7 +145,49 @@ def generate_shop_items(items_count: int) -> list:
     return shop_items
 
 
-@log_decorator
+@instrument
+def generate_shop_items_frame(items_count: int,
+                              rng: np.random.Generator,
+                              titles_count: int = 20) -> pd.DataFrame:
+    """columnar version of generate_shop_items, one row per shop item.
+    every title has at least one item, so the profiles weighting titles
+    never lose the weight of one"""
+    if titles_count > items_count:
+        raise ValueError(f"{titles_count} titles need at least as many "
+                         f"shop items, not {items_count}")
+    prices = np.arange(10, 200, 10)
+    titles = [f"Item{i}" for i in range(titles_count)]
+    descriptions = [f"Lorem {i}" for i in range(20)]
+    title_codes = rng.permutation(np.concatenate([
+        np.arange(len(titles)),
+        rng.integers(0, len(titles), size=items_count - len(titles))]))
+    description_codes = rng.integers(0, len(descriptions), size=items_count)
+    return pd.DataFrame({
+        "title": pd.Categorical.from_codes(title_codes, categories=titles),
+        "description": pd.Categorical.from_codes(description_codes,
+                                                 categories=descriptions),
+        "price": rng.choice(prices, size=items_count),
+        "quantity": rng.integers(10000, 100000, size=items_count,
+                                 endpoint=True),
+        "month": rng.integers(1, 12, size=items_count, endpoint=True),
+        "sold_count": np.zeros(items_count, dtype=np.int64),
+    })
+
+
+@instrument
+def shop_items_to_frame(shop_items: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "title": pd.Categorical([item.title for item in shop_items]),
+        "description": pd.Categorical([item.description
+                                       for item in shop_items]),
+        "price": [item.price for item in shop_items],
+        "quantity": [item.quantity for item in shop_items],
+        "month": [item.month for item in shop_items],
+        "sold_count": [item.sold_count for item in shop_items],
+    })
+
+
+@instrument
 def erase_json_file_data(path: str):
     with open(path, "w") as outfile:
         data = dict()
@@ -149,7 +200,7 @@ def erase_json_file_data(path: str):
         json.dump(data, outfile, ensure_ascii=False, indent=4)
 
 
-@log_decorator
+@instrument
 def write_json(new_data: dict, index: int, filename: str = 'sample.json'):
     with open(filename, 'r+') as file:
         file_data = json.load(file)
@@ -162,7 +213,38 @@ def write_json(new_data: dict, index: int, filename: str = 'sample.json'):
         json.dump(file_data, file, indent=4)
 
 
-@log_decorator
+@instrument
+def write_orders_json(store_orders: dict,
+                      filename: str = 'sample.json',
+                      chunk_size: int = 10000):
+    """write all orders in one pass, using the same column oriented layout
+    as write_json so pd.read_json can still load the file"""
+    with open(filename, "w", buffering=1024 * 1024) as outfile:
+        outfile.write("{")
+        for column_number, column in enumerate(ORDER_COLUMNS):
+            if column_number:
+                outfile.write(",")
+            outfile.write(f"{json.dumps(column)}:{{")
+            chunk = list()
+            is_first_chunk = True
+            for index, store_order in store_orders.items():
+                value = json.dumps(getattr(store_order, column))
+                chunk.append(f'"{index}":{value}')
+                if len(chunk) == chunk_size:
+                    if not is_first_chunk:
+                        outfile.write(",")
+                    outfile.write(",".join(chunk))
+                    chunk.clear()
+                    is_first_chunk = False
+            if chunk:
+                if not is_first_chunk:
+                    outfile.write(",")
+                outfile.write(",".join(chunk))
+            outfile.write("}")
+        outfile.write("}")
+
+
+@instrument
 def generate_store_orders(orders_count: int, shop_items: list) -> dict:
     store_orders = dict()
     for i in range(orders_count):
@@ -180,32 +262,376 @@ def generate_store_orders(orders_count: int, shop_items: list) -> dict:
     return store_orders
 
 
-@log_decorator
-def display_orders(store_orders: dict):
-    for i in store_orders.keys():
-        store_order = store_orders[i]
-        ic(store_order.__str__())
-        write_json(new_data=store_order.to_dictionary(),
-                   index=i,
-                   filename='sample.json')
+def iter_orders_frames(orders_count: int,
+                       shop_items: pd.DataFrame,
+                       rng: np.random.Generator,
+                       chunk_size: int = 1000000,
+                       profile: UniformProfile = None):
+    """the orders of generate_orders_frame one chunk at a time, shop_items
+    is updated after every chunk"""
+    draw_orders = (profile or UniformProfile()).sampler(shop_items)
+    prices = shop_items["price"].to_numpy()
+    months = shop_items["month"].to_numpy()
+    titles = shop_items["title"].astype("category")
+    quantity = shop_items["quantity"].to_numpy(dtype=np.int64, copy=True)
+    sold_count = shop_items["sold_count"].to_numpy(dtype=np.int64, copy=True)
+    items_count = len(shop_items)
+
+    for chunk_start in range(0, orders_count, chunk_size):
+        size = min(chunk_size, orders_count - chunk_start)
+        customer_ids, item_indexes, counts = draw_orders(rng, size)
+
+        # running count of each item's orders inside the chunk; once an
+        # item fails the buy_item check it fails for all its later orders
+        order = np.argsort(item_indexes, kind="stable")
+        sorted_items = item_indexes[order]
+        sorted_counts = counts[order]
+        running = np.cumsum(sorted_counts) - sorted_counts
+        group_start = np.searchsorted(sorted_items, sorted_items)
+        running -= running[group_start]
+        is_sold = np.empty(size, dtype=bool)
+        is_sold[order] = (sold_count[sorted_items] + 2 * running
+                          < quantity[sorted_items])
+
+        sold_items = item_indexes[is_sold]
+        sold_counts = counts[is_sold]
+        sold_per_item = np.bincount(sold_items, weights=sold_counts,
+                                    minlength=items_count).astype(np.int64)
+        sold_count += sold_per_item
+        quantity -= sold_per_item
+
+        shop_items["quantity"] = quantity
+        shop_items["sold_count"] = sold_count
+        yield pd.DataFrame({
+            "customer_id": customer_ids[is_sold],
+            "title": pd.Categorical.from_codes(
+                titles.cat.codes.to_numpy()[sold_items],
+                dtype=titles.dtype),
+            "month": months[sold_items],
+            "count": sold_counts,
+            "total_price": prices[sold_items] * sold_counts,
+        })
+
+
+@instrument
+def generate_orders_frame(orders_count: int,
+                          shop_items: pd.DataFrame,
+                          rng: np.random.Generator,
+                          chunk_size: int = 1000000,
+                          index_start: int = 0,
+                          profile: UniformProfile = None) -> pd.DataFrame:
+    """vectorized version of generate_store_orders.
+
+    orders are drawn chunk by chunk and the buy_item rule is applied to
+    each chunk at once: an order is sold only while the item's sold_count
+    is lower than its remaining quantity, later orders of an exhausted
+    item are dropped. shop_items "quantity" and "sold_count" are updated
+    in place. customers, items and counts are drawn by profile, uniform
+    by default. the result is reproducible for the same rng seed,
+    chunk_size and profile.
+    """
+    chunks = list(iter_orders_frames(orders_count=orders_count,
+                                     shop_items=shop_items, rng=rng,
+                                     chunk_size=chunk_size,
+                                     profile=profile))
+    if not chunks:
+        return pd.DataFrame(columns=list(ORDER_COLUMNS))
+    orders = pd.concat(chunks, ignore_index=True)
+    orders.index += index_start
+    return orders
+
+
+@instrument
+def generate_dataset(orders_count: int,
+                     items_count: int = 1000,
+                     seed: int = None,
+                     chunk_size: int = 1000000,
+                     profile: UniformProfile = None):
+    profile = profile or UniformProfile()
+    rng = np.random.default_rng(seed)
+    shop_items = generate_shop_items_frame(items_count=items_count, rng=rng,
+                                           titles_count=profile.titles)
+    store_orders = generate_orders_frame(orders_count=orders_count,
+                                         shop_items=shop_items,
+                                         rng=rng,
+                                         chunk_size=chunk_size,
+                                         profile=profile)
+    return shop_items, store_orders
+
+
+@instrument
+def stream_orders(orders_count: int,
+                  address: str,
+                  items_count: int = 1000,
+                  seed: int = None,
+                  batch_size: int = 100000,
+                  profile: UniformProfile = None):
+    """publish the orders of generate_dataset to the order stream at
+    address batch by batch instead of writing a file, see
+    common.streaming. returns the shop items and the number of orders
+    published"""
+    from common.streaming import OrderPublisher, open_stream
+    profile = profile or UniformProfile()
+    rng = np.random.default_rng(seed)
+    shop_items = generate_shop_items_frame(items_count=items_count, rng=rng,
+                                           titles_count=profile.titles)
+    with open_stream(address, "wb") as stream:
+        publisher = OrderPublisher(stream)
+        try:
+            for orders in iter_orders_frames(orders_count=orders_count,
+                                             shop_items=shop_items, rng=rng,
+                                             chunk_size=batch_size,
+                                             profile=profile):
+                publisher.send(orders)
+            publisher.close()
+        except BrokenPipeError:
+            logging.warning("The report closed the order stream")
+    return shop_items, publisher.orders
+
+
+@instrument
+def split_stock(quantity: np.ndarray, shards: int) -> np.ndarray:
+    """shards x items quantities that add up to quantity, the first shards
+    get one more unit when the quantity does not divide evenly"""
+    base, remainder = np.divmod(np.asarray(quantity, dtype=np.int64), shards)
+    return base + (np.arange(shards)[:, None] < remainder)
+
+
+def _generate_shard(task: dict) -> dict:
+    shop_items = task["shop_items"]
+    orders = generate_orders_frame(orders_count=task["orders"],
+                                   shop_items=shop_items,
+                                   rng=np.random.default_rng(task["seed"]),
+                                   chunk_size=task["chunk_size"],
+                                   index_start=task["index_start"],
+                                   profile=task["profile"])
+    if task["customer_buckets"]:
+        shards = partition_frame(orders, task["directory"],
+                                 part=f"{task['shard']:05d}",
+                                 customer_buckets=task["customer_buckets"],
+                                 partition_format=task["shard_format"])
+    else:
+        file = f"shard-{task['shard']:05d}.{task['shard_format']}"
+        save_orders(orders, os.path.join(task["directory"], file))
+        shards = [{"file": file,
+                   "rows": len(orders),
+                   "index_start": task["index_start"]}]
+    return {"shards": shards,
+            "quantity": shop_items["quantity"].to_numpy(),
+            "sold_count": shop_items["sold_count"].to_numpy()}
+
+
+@instrument
+def generate_sharded(orders_count: int,
+                     directory: str,
+                     shards: int,
+                     items_count: int = 1000,
+                     seed: int = None,
+                     processes: int = None,
+                     shard_format: str = "npz",
+                     chunk_size: int = 1000000,
+                     profile: UniformProfile = None,
+                     customer_buckets: int = None):
+    """generate_dataset split into shards drawn by a process pool.
+
+    every shard draws its share of the orders with its own seed spawned
+    from seed, against its own share of every item's stock, and writes
+    its orders to directory with an index range of its own. the manifest
+    listing the shards is written last, loaders read the directory as one
+    table. the orders only depend on seed and shards, not on processes.
+    with customer_buckets every shard is split further into one file per
+    month and bucket of customers, see common.partitions.
+    returns the shop items, with the stock left summed over the shards,
+    and the number of orders written.
+    """
+    profile = profile or UniformProfile()
+    seed_sequence = np.random.SeedSequence(seed)
+    items_seed, *shard_seeds = seed_sequence.spawn(shards + 1)
+    shop_items = generate_shop_items_frame(
+        items_count=items_count, rng=np.random.default_rng(items_seed),
+        titles_count=profile.titles)
+    stock = split_stock(shop_items["quantity"].to_numpy(), shards)
+    shard_orders = np.full(shards, orders_count // shards)
+    shard_orders[:orders_count % shards] += 1
+    index_starts = np.concatenate(([0], np.cumsum(shard_orders)[:-1]))
+
+    os.makedirs(directory, exist_ok=True)
+    tasks = list()
+    for shard in range(shards):
+        shard_items = shop_items.copy()
+        shard_items["quantity"] = stock[shard]
+        tasks.append({"shop_items": shard_items,
+                      "orders": int(shard_orders[shard]),
+                      "seed": shard_seeds[shard],
+                      "chunk_size": chunk_size,
+                      "index_start": int(index_starts[shard]),
+                      "profile": profile,
+                      "directory": directory,
+                      "shard": shard,
+                      "shard_format": shard_format,
+                      "customer_buckets": customer_buckets})
+
+    processes = min(processes or os.cpu_count() or 1, shards)
+    if processes == 1:
+        results = [_generate_shard(task) for task in tasks]
+    else:
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(processes=processes) as pool:
+            results = list(pool.imap(_generate_shard, tasks))
+
+    shop_items["quantity"] = sum(result.pop("quantity")
+                                 for result in results)
+    shop_items["sold_count"] = sum(result.pop("sold_count")
+                                   for result in results)
+    shard_files = [shard for result in results for shard in result["shards"]]
+    metadata = dict()
+    if customer_buckets:
+        shard_files.sort(key=lambda shard: shard["file"])
+        metadata = {"partition_by": ["month", "customer_id"],
+                    "customer_buckets": customer_buckets}
+    write_manifest(directory, shards=shard_files,
+                   orders=orders_count,
+                   items=items_count,
+                   profile=profile.name,
+                   entropy=str(seed_sequence.entropy),
+                   **metadata)
+    return shop_items, sum(shard["rows"] for shard in shard_files)
+
+
+@instrument
+def write_orders_frame(store_orders: pd.DataFrame,
+                       filename: str = 'sample.json'):
+    """write the orders, json or a typed columnar file (.parquet,
+    .feather, .npz) depending on the filename extension"""
+    save_orders(store_orders, filename)
+
+
+@instrument
+def store_orders_to_frame(store_orders: dict) -> pd.DataFrame:
+    return pd.DataFrame.from_dict(
+        {index: store_order.to_dictionary()
+         for index, store_order in store_orders.items()},
+        orient="index", columns=list(ORDER_COLUMNS))
+
+
+@instrument
+def display_orders(store_orders, sample_every: int = 1):
+    """ic every sample_every-th order, store_orders is a dict of
+    StoreOrder or an orders frame"""
+    # icecream inspects the caller's source, only loaded to debug
+    from icecream import ic
+    if isinstance(store_orders, pd.DataFrame):
+        for index, row in store_orders.iloc[::sample_every].iterrows():
+            ic(index, row.to_dict())
+    else:
+        for index in list(store_orders.keys())[::sample_every]:
+            ic(index, store_orders[index].__str__())
     ic(len(store_orders))
 
 
-@log_decorator
-def display_items(shop_items: list):
-    for shop_item in shop_items:
-        ic(shop_item.__str__())
+@instrument
+def display_items(shop_items, sample_every: int = 1):
+    """ic every sample_every-th shop item, shop_items is a list of
+    ShopItemInfo or a shop items frame"""
+    from icecream import ic
+    if isinstance(shop_items, pd.DataFrame):
+        for index, row in shop_items.iloc[::sample_every].iterrows():
+            ic(index, row.to_dict())
+    else:
+        for shop_item in shop_items[::sample_every]:
+            ic(shop_item.__str__())
     ic(len(shop_items))
 
 
-def main():
-    erase_json_file_data(path='sample.json')
-    shop_items = generate_shop_items(items_count=1000)
-    orders_count = random.randint(1500, 2000)
-    store_orders = generate_store_orders(orders_count=orders_count,
-                                         shop_items=shop_items)
-    display_items(shop_items=shop_items)
-    display_orders(store_orders=store_orders)
+@instrument
+def inventory_remaining(shop_items: pd.DataFrame) -> pd.DataFrame:
+    """quantity left and units sold per title"""
+    return shop_items.groupby("title", observed=True)[
+        ["quantity", "sold_count"]].sum()
+
+
+@instrument
+def log_summary(rows: int, elapsed: float, filename: str,
+                shop_items: pd.DataFrame):
+    rate = rows / elapsed if elapsed else 0.0
+    logging.info(f"{rows} orders written to {filename} in {elapsed:.2f}s "
+                 f"({rate:.0f} orders/s)")
+    inventory = inventory_remaining(shop_items)
+    logging.info("Inventory remaining per title\n"
+                 + inventory.to_string(header=["remaining", "sold"]))
+
+
+@instrument
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Order generator")
+    add_generate_arguments(parser)
+    args = parser.parse_args()
+    check_generate_arguments(parser, args)
+    return args
+
+
+def main(args: argparse.Namespace = None):
+    if args is None:
+        args = arg_input_parser()
+    random.seed(args.seed)
+    orders_count = args.orders
+    if orders_count is None:
+        orders_count = random.randint(1500, 2000)
+    profile = make_profile(args.profile, customers=args.customers,
+                           titles=args.titles)
+    started = time.perf_counter()
+    if args.stream:
+        items_frame, rows = stream_orders(orders_count=orders_count,
+                                          address=args.stream,
+                                          items_count=args.items,
+                                          seed=args.seed,
+                                          batch_size=args.batch_size,
+                                          profile=profile)
+        log_summary(rows=rows, elapsed=time.perf_counter() - started,
+                    filename=args.stream, shop_items=items_frame)
+        return
+    if args.shards or args.partition:
+        customer_buckets = args.customer_buckets if args.partition else None
+        items_frame, rows = generate_sharded(orders_count=orders_count,
+                                             directory=args.output,
+                                             shards=args.shards or 1,
+                                             items_count=args.items,
+                                             seed=args.seed,
+                                             processes=args.processes,
+                                             shard_format=args.shard_format,
+                                             profile=profile,
+                                             customer_buckets=customer_buckets)
+        log_summary(rows=rows, elapsed=time.perf_counter() - started,
+                    filename=args.output, shop_items=items_frame)
+        return
+    if args.engine == "vectorized":
+        shop_items, store_orders = generate_dataset(
+            orders_count=orders_count, items_count=args.items,
+            seed=args.seed, profile=profile)
+        write_orders_frame(store_orders, filename=args.output)
+        items_frame = shop_items
+    else:
+        shop_items = generate_shop_items(items_count=args.items)
+        store_orders = generate_store_orders(orders_count=orders_count,
+                                             shop_items=shop_items)
+        if file_format(args.output) == "json":
+            write_orders_json(store_orders=store_orders,
+                              filename=args.output)
+        else:
+            write_orders_frame(store_orders_to_frame(store_orders),
+                               filename=args.output)
+        items_frame = shop_items_to_frame(shop_items)
+    elapsed = time.perf_counter() - started
+
+    if args.verbosity == "debug":
+        display_items(shop_items=shop_items, sample_every=args.sample_every)
+        display_orders(store_orders=store_orders,
+                       sample_every=args.sample_every)
+    log_summary(rows=len(store_orders), elapsed=elapsed,
+                filename=args.output, shop_items=items_frame)
 
 
 if __name__ == "__main__":
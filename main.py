@@ -0,0 +1,113 @@
+"""one entry point for the four tools.
+
+    python main.py generate --orders 100000 --output orders.npz
+    python main.py customer --data-file orders.npz
+    python main.py product --data-file orders.npz
+    python main.py report -r --data-file orders.npz
+    python main.py --import-times report --data-file orders.npz
+    python main.py generate --orders 10000000 --stream - \
+        | python main.py report --stream - --output-dir out
+
+the arguments are parsed before the tool is imported, and the tools only
+import numpy, pandas and matplotlib once they need them, so --help, bad
+options and the paths that load no data start without them. pyplot and
+its GUI backend are only imported to show a window.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+
+from common.options import (add_customer_arguments, add_generate_arguments,
+                            add_product_arguments, add_report_arguments,
+                            check_customer_arguments,
+                            check_generate_arguments,
+                            check_product_arguments, check_report_arguments)
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# command -> (tool script, description, add arguments, check arguments)
+COMMANDS = {
+    "generate": ("information/main.py", "Order generator",
+                 add_generate_arguments, check_generate_arguments),
+    "customer": ("ChartsPurchases/main.py", "Customer purchase analysis",
+                 add_customer_arguments, check_customer_arguments),
+    "product": ("ChartSales/main.py", "Sales and price charts",
+                add_product_arguments, check_product_arguments),
+    "report": ("BestSellingProducts/main.py", "Sales data visualisation",
+               add_report_arguments, check_report_arguments),
+}
+# packages listed by --import-times, the rest are summed up as "other"
+IMPORT_TIMES_SHOWN = 15
+
+logging.basicConfig(level=logging.INFO)
+
+
+def load_tool(command: str):
+    """import the main.py of a tool, they cannot be imported by name.
+    the module is registered under its spec name, so that pickle finds
+    the functions a tool hands to its process pool"""
+    spec = importlib.util.spec_from_file_location(
+        f"{command}_tool", os.path.join(ROOT, COMMANDS[command][0]))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def arg_input_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Order analysis tools")
+    parser.add_argument("--import-times",
+                        help="Run the command under python -X importtime "
+                             "and log the import time per package",
+                        action="store_true",
+                        )
+    commands = parser.add_subparsers(dest="command", required=True)
+    command_parsers = dict()
+    for command, (_, description, add_arguments, _) in COMMANDS.items():
+        command_parsers[command] = commands.add_parser(
+            command, help=description, description=description)
+        add_arguments(command_parsers[command])
+    args = parser.parse_args()
+    check_arguments = COMMANDS[args.command][3]
+    check_arguments(command_parsers[args.command], args)
+    return args
+
+
+def import_times(argv: list) -> int:
+    """run the command again under -X importtime, log the import time of
+    every top level package, slowest first, and return its exit status"""
+    import subprocess
+    command = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__),
+         *argv], stderr=subprocess.PIPE, text=True)
+    totals = dict()
+    for line in command.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+            continue
+        # import time: self [us] | cumulative | imported package
+        self_time, _, package = line[len("import time:"):].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        package = package.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_time)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    other = sum(micros for _, micros in ranked[IMPORT_TIMES_SHOWN:])
+    for package, micros in ranked[:IMPORT_TIMES_SHOWN] + [("other", other)]:
+        logging.info(f"{package:<24} {micros / 1000:8.1f} ms")
+    logging.info(f"{'total':<24} {sum(totals.values()) / 1000:8.1f} ms")
+    return command.returncode
+
+
+def main() -> int:
+    args = arg_input_parser()
+    if args.import_times:
+        return import_times([arg for arg in sys.argv[1:]
+                             if arg != "--import-times"])
+    return load_tool(args.command).main(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the tools are run from their own directories and put the repository root
+# on sys.path themselves, the tests do the same
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.cube import CUBE_FILE_SUFFIX, OrderCube
+from common.options import RANKINGS
+from common.storage import save_orders
+
+
+def make_orders(size: int = 2000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, 11, size)
+    prices = rng.integers(1, 500, size).astype(np.float64)
+    return pd.DataFrame({
+        "customer_id": rng.integers(1, 11, size),
+        "title": pd.Categorical(
+            [f"Item{i}" for i in rng.integers(0, 20, size)],
+            categories=[f"Item{i}" for i in range(20)]),
+        "month": rng.integers(1, 13, size),
+        "count": counts,
+        "total_price": prices * counts,
+    })
+
+
+@pytest.fixture
+def orders() -> pd.DataFrame:
+    return make_orders()
+
+
+def grouped(orders: pd.DataFrame, by) -> pd.DataFrame:
+    """the cube measures with a pandas groupby"""
+    return orders.assign(
+        orders=1, price_sum=orders["total_price"] / orders["count"],
+    ).groupby(by, observed=True)[
+        ["orders", "count", "total_price", "price_sum"]].sum()
+
+
+def assert_same_stats(cube_stats: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(
+        cube_stats.astype(np.float64), expected.astype(np.float64),
+        check_names=False, check_index_type=False,
+        check_categorical=False)
+
+
+def test_monthly_matches_groupby(orders):
+    cube = OrderCube.from_orders(orders)
+    assert_same_stats(cube.monthly(), grouped(orders, "month"))
+    customer = orders[orders["customer_id"] == 3]
+    assert_same_stats(cube.monthly(customer_id=3),
+                      grouped(customer, "month"))
+    title = orders[orders["title"] == "Item7"]
+    assert_same_stats(cube.monthly(title="Item7"), grouped(title, "month"))
+
+
+def test_per_title_matches_groupby(orders):
+    cube = OrderCube.from_orders(orders)
+    assert_same_stats(cube.per_title(), grouped(orders, "title"))
+    selected = orders[(orders["customer_id"] == 5) & (orders["month"] == 2)]
+    assert_same_stats(cube.per_title(customer_id=5, month=2),
+                      grouped(selected, "title"))
+
+
+@pytest.mark.parametrize("by", sorted(RANKINGS))
+def test_top_titles_matches_groupby(orders, by):
+    cube = OrderCube.from_orders(orders)
+    totals = grouped(orders, "title")[RANKINGS[by]]
+    expected = totals.sort_index().sort_values(ascending=False,
+                                               kind="stable").iloc[:5]
+    top = cube.top_titles(k=5, by=by)
+    assert list(top.index) == list(expected.index)
+    np.testing.assert_allclose(top.to_numpy(), expected.to_numpy())
+
+
+def test_monthly_per_title_matches_groupby(orders):
+    cube = OrderCube.from_orders(orders)
+    titles = ["Item1", "Item2"]
+    expected = grouped(orders[orders["title"].isin(titles)],
+                       ["title", "month"])
+    assert_same_stats(cube.monthly_per_title(titles), expected)
+
+
+def test_append_matches_one_build(orders):
+    cube = OrderCube.from_orders(orders.iloc[:700])
+    version = cube.version
+    cube.append(orders.iloc[700:])
+    assert cube.version > version
+    assert cube.orders_count == len(orders)
+    assert_same_stats(cube.per_title(), grouped(orders, "title"))
+    assert_same_stats(cube.monthly(customer_id=2),
+                      grouped(orders[orders["customer_id"] == 2], "month"))
+
+
+def test_cached_cube_is_rebuilt_after_the_file_changes(tmp_path, orders):
+    file_name = str(tmp_path / "orders.npz")
+    save_orders(orders, file_name)
+    builds = list()
+
+    def build():
+        builds.append(file_name)
+        return OrderCube.from_file(file_name)
+
+    first = OrderCube.cached(file_name, build)
+    assert os.path.exists(file_name + CUBE_FILE_SUFFIX)
+    again = OrderCube.cached(file_name, build)
+    assert len(builds) == 1
+    assert_same_stats(again.per_title(), first.per_title())
+
+    # another size, so the fingerprint differs even within one mtime tick
+    changed = make_orders(size=1500, seed=1)
+    save_orders(changed, file_name)
+    rebuilt = OrderCube.cached(file_name, build)
+    assert len(builds) == 2
+    assert_same_stats(rebuilt.per_title(), grouped(changed, "title"))
@@ -0,0 +1,42 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+from common.profiles import ZipfProfile, zipf_weights
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def generator():
+    # the tool scripts cannot be imported by name
+    spec = importlib.util.spec_from_file_location(
+        "generator", os.path.join(ROOT, "information", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("titles, items", [(20, 20), (50, 60), (5, 1000)])
+def test_every_title_has_an_item(generator, titles, items):
+    for seed in range(5):
+        shop_items = generator.generate_shop_items_frame(
+            items, np.random.default_rng(seed), titles_count=titles)
+        assert len(shop_items) == items
+        assert set(shop_items["title"]) == set(
+            shop_items["title"].cat.categories)
+
+
+def test_zipf_keeps_the_weight_of_every_title(generator):
+    shop_items = generator.generate_shop_items_frame(
+        30, np.random.default_rng(0), titles_count=25)
+    weights = ZipfProfile(titles=25).item_weights(shop_items)
+    np.testing.assert_allclose(weights.sum(), zipf_weights(25, 1.1).sum())
+
+
+def test_more_titles_than_items_is_refused(generator):
+    with pytest.raises(ValueError):
+        generator.generate_shop_items_frame(
+            10, np.random.default_rng(0), titles_count=11)
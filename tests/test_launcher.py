@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+from common.storage import load_orders, read_manifest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_generate_shards_in_processes(tmp_path):
+    # the shard function of the generator is pickled for the pool, which
+    # needs the tool module the launcher loaded to be importable
+    output = str(tmp_path / "orders")
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), "generate",
+         "--orders", "2000", "--seed", "7", "--shards", "2",
+         "--processes", "2", "--output", output],
+        cwd=tmp_path, check=True, capture_output=True)
+    manifest = read_manifest(output)
+    assert len(manifest["shards"]) == 2
+    assert len(load_orders(output)) == manifest["orders"] == 2000
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pytest
+
+from common.cube import CUBE_FILE_SUFFIX, OrderCube, cube_file_name
+from common.partitions import write_partitioned
+from common.storage import (load_orders, read_manifest, save_orders,
+                            select_shards)
+from test_cube import assert_same_stats, grouped, make_orders
+
+
+@pytest.fixture
+def dataset(tmp_path) -> tuple:
+    orders = make_orders()
+    file_name = str(tmp_path / "orders.npz")
+    save_orders(orders, file_name)
+    directory = str(tmp_path / "partitioned")
+    write_partitioned(file_name, directory, customer_buckets=2,
+                      chunk_size=500)
+    return orders, directory
+
+
+def test_pruned_load_matches_filtered_load(dataset):
+    orders, directory = dataset
+    shards = select_shards(read_manifest(directory)["shards"], {"month": 3})
+    assert shards and all(shard["month"] == 3 for shard in shards)
+    pruned = load_orders(directory, filters={"month": 3})
+    expected = orders[orders["month"] == 3]
+    assert len(pruned) == len(expected)
+    assert_same_stats(grouped(pruned, "title"), grouped(expected, "title"))
+
+
+def test_list_filter_keeps_any_value(dataset):
+    orders, directory = dataset
+    titles = ["Item2", "Item5"]
+    cube = OrderCube.from_file(directory, filters={"title": titles},
+                               processes=1)
+    expected = grouped(orders[orders["title"].isin(titles)],
+                       ["title", "month"])
+    assert_same_stats(cube.monthly_per_title(titles), expected)
+    shards = read_manifest(directory)["shards"]
+    assert len(select_shards(shards, {"month": [2, 11]})) < len(shards)
+
+
+def test_filtered_cube_is_saved_apart(dataset):
+    orders, directory = dataset
+    filters = {"month": 3}
+    month_file = cube_file_name(directory, filters)
+    assert month_file != cube_file_name(directory)
+    assert cube_file_name(directory + os.sep) == directory + CUBE_FILE_SUFFIX
+
+    month_cube = OrderCube.cached(
+        directory, lambda: OrderCube.from_file(directory, filters=filters,
+                                               processes=1),
+        filters=filters)
+    assert os.path.exists(month_file)
+    assert month_cube.orders_count == int((orders["month"] == 3).sum())
+
+    # the full cube is built, not taken from the month cube file
+    full_cube = OrderCube.cached(
+        directory, lambda: OrderCube.from_file(directory, processes=1))
+    assert full_cube.orders_count == len(orders)
+    assert_same_stats(full_cube.per_title(), grouped(orders, "title"))
+    np.testing.assert_array_equal(
+        month_cube.top_titles(k=3, month=3).index,
+        full_cube.top_titles(k=3, month=3).index)
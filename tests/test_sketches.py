@@ -0,0 +1,109 @@
+import io
+import numpy as np
+import pytest
+
+from common.cube import OrderCube
+from common.sketches import HyperLogLog, SpaceSaving, bit_length
+from common.streaming import (ORDERS, TITLES, OrderPublisher, StreamingStats,
+                              iter_messages)
+from test_cube import assert_same_stats, make_orders
+
+
+def zipf_batches(keys: int = 1000, size: int = 50000, batch: int = 2000,
+                 seed: int = 0):
+    """batches of distinct keys and their weights, of a zipf stream"""
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, keys + 1) ** 1.2
+    stream = rng.choice(keys, size=size, p=popularity / popularity.sum())
+    for start in range(0, size, batch):
+        weights = np.bincount(stream[start:start + batch], minlength=keys)
+        batch_keys = np.flatnonzero(weights)
+        yield batch_keys, weights[batch_keys].astype(np.float64)
+
+
+def test_bit_length_matches_int():
+    values = np.array([0, 1, 2, 3, 2 ** 53 + 1, 2 ** 63, 2 ** 64 - 1],
+                      dtype=np.uint64)
+    assert bit_length(values).tolist() == [int(value).bit_length()
+                                           for value in values.tolist()]
+
+
+def test_space_saving_bounds_and_top_k():
+    capacity, keys = 64, 1000
+    summary = SpaceSaving(capacity)
+    truth = np.zeros(keys)
+    for batch_keys, weights in zipf_batches(keys=keys):
+        summary.update(batch_keys, weights)
+        truth[batch_keys] += weights
+    slots = summary.tracked()
+    tracked = summary.keys[slots]
+    counts = summary.counts[slots]
+    # a count overestimates the true weight by at most its error
+    assert np.all(counts >= truth[tracked])
+    assert np.all(counts - summary.errors[slots] <= truth[tracked])
+    # every key heavier than total / capacity is tracked
+    heavy = np.flatnonzero(truth > truth.sum() / capacity)
+    assert set(heavy) <= set(tracked.tolist())
+    top = tracked[np.argsort(-counts, kind="stable")[:5]]
+    assert top.tolist() == np.argsort(-truth, kind="stable")[:5].tolist()
+
+
+@pytest.mark.parametrize("precision", [10, 12])
+@pytest.mark.parametrize("cardinality", [50, 2000, 100000])
+def test_hyperloglog_error(precision, cardinality):
+    sketch = HyperLogLog(2, precision=precision)
+    values = np.arange(cardinality, dtype=np.int64) * 7919
+    # every value twice, duplicates must not count
+    rows = np.zeros(2 * cardinality, dtype=np.int64)
+    sketch.add(rows, np.concatenate([values, values[::-1]]))
+    estimate = sketch.estimate(np.array([0, 1]))
+    # three standard errors of 1.04 / sqrt(2 ** precision)
+    bound = 3 * 1.04 / np.sqrt(1 << precision)
+    assert abs(estimate[0] - cardinality) <= bound * cardinality
+    assert estimate[1] == 0
+
+
+def streamed(orders, by: str = "units", capacity: int = 256) -> tuple:
+    stream = io.BytesIO()
+    publisher = OrderPublisher(stream)
+    for start in range(0, len(orders), 300):
+        publisher.send(orders.iloc[start:start + 300])
+    publisher.close()
+    stream.seek(0)
+    stats = StreamingStats(by=by, capacity=capacity)
+    for kind, payload in iter_messages(stream):
+        if kind == TITLES:
+            stats.add_titles(payload)
+        elif kind == ORDERS:
+            stats.update(payload)
+    return stats
+
+
+def test_streaming_stats_match_cube():
+    orders = make_orders()
+    cube = OrderCube.from_orders(orders)
+    # more slots than titles, so the summary counts are exact
+    stats = streamed(orders)
+    assert stats.orders_count == len(orders)
+    assert_same_stats(stats.monthly(), cube.monthly())
+    top = stats.top_titles(k=5)
+    expected = cube.top_titles(k=5)
+    assert sorted(top.index) == sorted(expected.index)
+    np.testing.assert_allclose(np.sort(top.to_numpy()),
+                               np.sort(expected.to_numpy()))
+    titles = [str(title) for title in expected.index[:2]]
+
+    def by_title(stats):
+        stats = stats.reset_index()
+        return stats.astype({"title": str}).set_index(
+            ["title", "month"]).sort_index()
+
+    assert_same_stats(by_title(stats.monthly_per_title(titles)),
+                      by_title(cube.monthly_per_title(titles)))
+    customers = stats.distinct_customers(titles)
+    expected_customers = orders[orders["title"].isin(titles)].groupby(
+        "title", observed=True)["customer_id"].nunique()
+    np.testing.assert_allclose(
+        customers.sort_index().to_numpy(),
+        expected_customers.rename(index=str).sort_index().to_numpy(),
+        rtol=0.1)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.cube import OrderCube
+from common.sql import SqlOrderStore
+from common.storage import load_orders, save_orders
+from test_cube import make_orders
+
+
+@pytest.fixture
+def stores(tmp_path):
+    # category order Item0, Item1, ..., Item19, not sorted as text
+    file_name = str(tmp_path / "orders.npz")
+    save_orders(make_orders(), file_name)
+    return (OrderCube.from_orders(load_orders(file_name)),
+            SqlOrderStore.cached(file_name))
+
+
+def test_titles_in_cube_order(stores):
+    cube, sql = stores
+    assert list(sql.titles()) == list(cube.titles())
+    assert list(sql.per_title().index) == list(cube.per_title().index)
+    assert (list(sql.per_title(month=4).index)
+            == list(cube.per_title(month=4).index))
+    titles = ["Item11", "Item2", "Item1"]
+    assert (list(sql.monthly_per_title(titles).index)
+            == list(cube.monthly_per_title(titles).index))
+
+
+@pytest.mark.parametrize("by", ["units", "revenue"])
+def test_top_titles_match_the_cube(stores, by):
+    cube, sql = stores
+    expected = cube.top_titles(k=20, by=by)
+    top = sql.top_titles(k=20, by=by)
+    assert list(top.index) == list(expected.index)
+    np.testing.assert_allclose(top.to_numpy(dtype=np.float64),
+                               expected.to_numpy(dtype=np.float64))
+    empty = sql.top_titles(k=0, by=by)
+    assert empty.empty
+    assert pd.api.types.is_numeric_dtype(empty.dtype)